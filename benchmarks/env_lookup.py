@@ -0,0 +1,71 @@
+'''
+Measure the cost of looking up an attribute on an
+:class:`ExtendableEnvironment` as the chain of sub-environments grows.
+
+The lookup should cost roughly the same regardless of how many
+sub-environments precede the one that provides the attribute. A linear walk
+of the chain, as used before environments were indexed, is timed alongside
+for comparison.
+
+Run with::
+
+    $ python2 benchmarks/env_lookup.py
+
+'''
+# setup python path
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import timeit
+
+from roots.app import ExtendableEnvironment, ConfigEnv
+
+
+class LinearEnvironment(object):
+    '''The original, unindexed environment lookup.'''
+
+    def __init__(self):
+        self._environments = []
+
+    def extend_environment(self, env):
+        self._environments.append(env)
+
+    def __getattr__(self, key):
+        for env in self._environments:
+            try:
+                return getattr(env, key)
+            except AttributeError:
+                pass
+        raise AttributeError(key)
+
+
+class Padding(object):
+    '''A sub-environment that provides nothing of interest.'''
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = None
+
+
+def build(env_class, length):
+    env = env_class()
+    for n in range(length):
+        env.extend_environment(Padding())
+    env.extend_environment(ConfigEnv({}))
+    return env
+
+
+def time_lookup(env, number):
+    return min(timeit.repeat(lambda: env.config, number=number, repeat=5))
+
+
+if __name__ == '__main__':
+    number = 100000
+    print "%8s %14s %14s" % ("chain", "indexed (us)", "linear (us)")
+    for length in (0, 1, 2, 4, 8, 16, 32):
+        indexed = time_lookup(build(ExtendableEnvironment, length), number)
+        linear = time_lookup(build(LinearEnvironment, length), number)
+        print "%8d %14.3f %14.3f" % (length + 1,
+                                      indexed * 1e6 / number,
+                                      linear * 1e6 / number)
@@ -0,0 +1,84 @@
+'''
+Measure how long a management script with many commands takes to start.
+
+A script defining `COMMANDS` commands, each with a few options, is run as a
+subprocess to invoke a single command, as cron would. The time to define the
+commands is also measured in-process, both as defined (parsers are built
+lazily) and with every parser built up front, as they were before.
+
+Run with::
+
+    $ python2 benchmarks/startup.py
+
+'''
+# setup python path
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import subprocess
+import tempfile
+import timeit
+
+from roots.command import command
+
+
+COMMANDS = 200
+RUNS = 10
+
+SCRIPT = '''
+import sys
+sys.path.insert(0, %(path)r)
+
+from roots.app import App
+from roots.command import command
+from roots.manager import Manager
+
+manager = Manager(App('startup'))
+for n in range(%(commands)d):
+    @command(name="command%%d" %% n, arguments={'count': {'type': int}})
+    def _command(manager, name="x", count=1, verbose=False, tag=[]):
+        """A command with a few options."""
+    manager.commands.add(_command)
+
+if __name__ == '__main__':
+    manager.main()
+'''
+
+
+def define_commands(build_parsers=False):
+    for n in range(COMMANDS):
+        @command(name="command%d" % n, arguments={'count': {'type': int}})
+        def _command(manager, name="x", count=1, verbose=False, tag=[]):
+            '''A command with a few options.'''
+        if build_parsers:
+            _command.parser()
+
+
+def time_script(path, argv):
+    times = timeit.repeat(
+        lambda: subprocess.check_call([sys.executable, path] + argv),
+        number=1, repeat=RUNS)
+    return sorted(times)[len(times) // 2]
+
+
+if __name__ == '__main__':
+    lazy = min(timeit.repeat(define_commands, number=1, repeat=5))
+    eager = min(timeit.repeat(lambda: define_commands(True),
+                              number=1, repeat=5))
+    print "Defining %d commands: %.1fms lazy, %.1fms building parsers" % (
+        COMMANDS, lazy * 1000, eager * 1000)
+
+    fd, path = tempfile.mkstemp(suffix='.py')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(SCRIPT % {
+                    'path': os.path.join(os.path.dirname(__file__), ".."),
+                    'commands': COMMANDS,
+                    })
+        baseline = time_script('-c', ['pass'])
+        run = time_script(path, ['command7', '--count', '3'])
+        print "Running one command: %.1fms (interpreter start: %.1fms)" % (
+            run * 1000, baseline * 1000)
+    finally:
+        os.remove(path)
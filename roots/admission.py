@@ -0,0 +1,191 @@
+'''
+Admission control for mounted apps and routes, with the `limit` option of
+:meth:`App.mount` and :meth:`App.route`::
+
+    from roots.admission import Limit
+
+    app.mount(reports, '/reports', limit=Limit(concurrency=4, rate=20))
+
+A request is checked against the limits of the route and of every mount
+it is under, outermost first, before its environment is built. Requests
+over a limit are answered immediately, so a slow app can't hold every
+worker while the others stay responsive:
+
+- Requests beyond the token bucket `rate` get `429 Too Many Requests`.
+- Requests beyond `concurrency` get `503 Service Unavailable`, unless there
+  is room among the `queue` requests allowed to wait up to
+  `queue_timeout` seconds for one to finish.
+
+A request counts against the concurrency of its limits until its response
+is closed. Sharing a :class:`Limit` between mounts shares its capacity.
+
+'''
+import weakref
+from threading import Condition, Lock
+from time import time
+
+from werkzeug.wrappers import Response
+
+from roots.utils.wsgi import close_after
+
+
+# Every limit, for reporting. See `stats`.
+_limits = weakref.WeakSet()
+
+
+def _reject(status, retry_after):
+    return Response(status.split(' ', 1)[1], status=status,
+                    headers=[('Retry-After', str(retry_after))],
+                    content_type='text/plain')
+
+
+class Limit(object):
+    '''
+    Limits on the requests to a mounted app or a route.
+
+    :param concurrency: Maximum number of requests in progress, or `None`
+        for no limit.
+    :param rate: Requests admitted per second on average, or `None` for no
+        limit.
+    :param burst: Requests admitted at once after a quiet period. Default:
+        `rate`, and at least 1.
+    :param queue: Number of requests that may wait for a request in progress
+        to finish when `concurrency` is reached.
+    :param queue_timeout: Seconds a request may wait in the queue.
+    :param retry_after: Seconds to send in the `Retry-After` header of
+        rejected requests.
+    :param name: Name to report counters under. Default: the full path of
+        the mount, or the name of the view.
+
+    '''
+    def __init__(self, concurrency=None, rate=None, burst=None, queue=0,
+                 queue_timeout=1.0, retry_after=1, name=None):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst or max(rate or 0, 1)
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._name = name
+
+        self._condition = Condition(Lock())
+        self._active = 0
+        self._waiting = 0
+        self._tokens = self.burst
+        self._refilled = time()
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._rate_limited = 0
+        _limits.add(self)
+
+    @property
+    def name(self):
+        '''The name of the limit, or `None` until it is used.'''
+        name = self._name
+        return name() if callable(name) else name
+
+    @name.setter
+    def name(self, name):
+        # A callable is called for the name when it is read, for names that
+        # change, like the full path of a mount.
+        self._name = name
+
+    def _take_token(self):
+        now = time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def admit(self):
+        '''
+        Admit a request, which must be followed by a call to
+        :meth:`release` once it is done.
+
+        :returns: `None` if the request is admitted, or else a WSGI app
+            rejecting it.
+
+        '''
+        with self._condition:
+            if self.rate is not None and not self._take_token():
+                self._rate_limited += 1
+                return _reject('429 Too Many Requests', self.retry_after)
+
+            if self.concurrency is not None and \
+                    self._active >= self.concurrency:
+                if self._waiting >= self.queue:
+                    self._rejected += 1
+                    return _reject('503 Service Unavailable',
+                                   self.retry_after)
+
+                self._waiting += 1
+                self._queued += 1
+                deadline = time() + self.queue_timeout
+                try:
+                    while self._active >= self.concurrency:
+                        remaining = deadline - time()
+                        if remaining <= 0:
+                            self._rejected += 1
+                            return _reject('503 Service Unavailable',
+                                           self.retry_after)
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._active += 1
+            self._admitted += 1
+            return None
+
+    def release(self):
+        '''Finish a request admitted by :meth:`admit`.'''
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        ''':returns: a dictionary of the admission counters.'''
+        with self._condition:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'rejected': self._rejected,
+                'rate_limited': self._rate_limited,
+                }
+
+
+def admit(limits):
+    '''
+    Admit a request by each of `limits` in turn.
+
+    :returns: `None` if every limit admitted the request, or else a WSGI
+        app rejecting it. Limits that admitted it are released.
+
+    '''
+    for position, limit in enumerate(limits):
+        rejection = limit.admit()
+        if rejection is not None:
+            release(limits[:position])
+            return rejection
+    return None
+
+
+def release(limits):
+    '''Release a request admitted by :func:`admit`.'''
+    for limit in reversed(limits):
+        limit.release()
+
+
+def release_after(app_iter, limits):
+    ''':returns: `app_iter`, wrapped to release `limits` once closed.'''
+    return close_after(app_iter, lambda: release(limits))
+
+
+def stats():
+    ''':returns: a dictionary of limit name -> counters.'''
+    return dict((limit.name, limit.stats()) for limit in list(_limits))
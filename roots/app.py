@@ -1,6 +1,18 @@
+from threading import RLock
+from time import time
+
 from werkzeug.exceptions import HTTPException
 from werkzeug.wrappers import Request
-from werkzeug.routing import Rule, Map, Submount
+from werkzeug.routing import Rule, Map
+
+from roots.admission import Limit, admit, release, release_after
+from roots.coalescing import CoalescePolicy, coalesce
+from roots.compression import Compressor, CompressionPolicy
+from roots.dispatch import DispatchTable
+from roots.response_cache import CachedView, CachePolicy
+from roots.utils.cache import LRUCache
+from roots.utils.histogram import LatencyHistograms
+from roots.utils.wsgi import close_after
 
 
 # Define some useful exceptions.
@@ -27,6 +39,116 @@ class RootsConfigError(Exception):
 # Define the various classes that make up the 'environment' passed through to
 # views.
 
+class _ChainIndex(object):
+    '''
+    Resolves attribute names for a particular chain of environment classes.
+
+    For each name, the index records which positions in the chain could
+    provide it: environments whose class defines the name, environments whose
+    instances have a `__dict__` that might hold it, and environments that
+    compute attributes dynamically. Everything else is skipped without
+    raising an :class:`AttributeError`.
+
+    Each link in the chain is either a class or the :attr:`key` of a
+    :class:`LazyEnvironment`. Indexes form a tree: :meth:`extended` returns
+    the (shared) index for this chain with one more link appended.
+
+    '''
+    def __init__(self, links=()):
+        self._links = links
+        self._extensions = {}
+        self._candidates = {}
+
+    def extended(self, link):
+        index = self._extensions.get(link)
+        if index is None:
+            index = self._extensions.setdefault(
+                link, _ChainIndex(self._links + (link,)))
+        return index
+
+    def candidates(self, key):
+        '''
+        :returns: a tuple of `(position, check_dict)` pairs, in chain order.
+            If `check_dict` is true, the environment at that position only
+            provides `key` when it is in the instance `__dict__`.
+
+        '''
+        candidates = self._candidates.get(key)
+        if candidates is None:
+            candidates = self._candidates[key] = tuple(
+                (position, not defines)
+                for position, (defines, maybe) in enumerate(
+                    _provision(link, key) for link in self._links)
+                if defines or maybe)
+        return candidates
+
+
+# Cache of class -> (attribute names, instances have a dict, dynamic).
+_class_attributes = {}
+
+
+def _class_provision(cls, key):
+    '''
+    :returns: a tuple of two flags. The first is true if instances of `cls`
+        always try to provide `key`, the second if they may have it in their
+        instance `__dict__`.
+
+    '''
+    attributes = _class_attributes.get(cls)
+    if attributes is None:
+        if isinstance(cls, type):
+            names = frozenset(dir(cls))
+            dynamic = (hasattr(cls, '__getattr__') or
+                       cls.__getattribute__ is not object.__getattribute__)
+        else:
+            # Old style classes are always looked up the slow way.
+            names = frozenset()
+            dynamic = True
+        attributes = _class_attributes[cls] = (
+            names, '__dict__' in names, dynamic)
+
+    names, has_dict, dynamic = attributes
+    return dynamic or key in names, has_dict
+
+
+def _provision(link, key):
+    '''As :func:`_class_provision`, for a link in an environment chain.'''
+    if isinstance(link, tuple):
+        # A lazy environment only provides its class attributes and the
+        # instance attributes it declares.
+        cls, names = link
+        defines, maybe = _class_provision(cls, key)
+        return defines or key in names, False
+    return _class_provision(link, key)
+
+
+class LazyEnvironment(object):
+    '''
+    A sub-environment that is only constructed when one of its attributes is
+    first accessed. It can be passed to
+    :meth:`ExtendableEnvironment.extend_environment` or
+    :meth:`App.extend_environment` in place of a sub-environment.
+
+    A lazy environment holds no per-request state, so it can be created once
+    and shared.
+
+    :param cls: The class of the sub-environment. Accessing any attribute
+        defined on the class constructs the sub-environment.
+    :param factory: Called with the :class:`ExtendableEnvironment` to
+        construct the sub-environment. Default: `cls`, with no arguments.
+    :param names: Additional attribute names that construct the
+        sub-environment, for attributes set on the instance rather than
+        defined on the class.
+
+    '''
+    __slots__ = ('cls', 'factory', 'key')
+
+    def __init__(self, cls, factory=None, names=()):
+        self.cls = cls
+        self.factory = factory or (lambda env: cls())
+        self.key = (cls, tuple(names))
+
+
 class ExtendableEnvironment(object):
     '''
     An environment is a 'catch-all' convenience object. It is a composite of
@@ -36,25 +158,56 @@ class ExtendableEnvironment(object):
     Constructed by the :class:`App` on each request and passed in to the view.
     This object defers to a chain of sub-environments. The sub environments
     included by default are the :class:`Request` object itself, a
-    :class:`ConfigEnv` which provides the :attr:`config` property and a
-    :class:`ReverseEnv` which provides the :meth:`reverse` method.
+    :class:`ConfigEnv` which provides the :attr:`config` property, a
+    :class:`ReverseEnv` which provides the :meth:`reverse` method and a
+    :class:`DeferEnv` which provides the :meth:`defer` method.
+
+    Attribute lookups go through an index shared by every environment with
+    the same chain of sub-environment classes, so only sub-environments that
+    could provide an attribute are consulted. The default sub-environments
+    are :class:`LazyEnvironment` instances, and are only constructed if the
+    view uses them.
+
+    :param environ: The WSGI environment of the request.
+    :param config: The :class:`Config` of the :class:`Manager`.
+    :param map_adapter: App routes bound to `environ`.
 
     '''
-    def __init__(self):
+    __slots__ = ('_environments', '_index',
+                 '_environ', '_config', '_map_adapter')
+
+    _root_index = _ChainIndex()
+
+    def __init__(self, environ=None, config=None, map_adapter=None):
         self._environments = []
+        self._index = self._root_index
+        self._environ = environ
+        self._config = config
+        self._map_adapter = map_adapter
 
     def extend_environment(self, env):
         '''
-        Extend this environment with a sub-environment.
+        Extend this environment with a sub-environment, or a
+        :class:`LazyEnvironment` to construct one on demand.
 
         The environment is appended to the end of the chain, and so has the
         least priority.
 
         '''
         self._environments.append(env)
+        if env.__class__ is LazyEnvironment:
+            self._index = self._index.extended(env.key)
+        else:
+            self._index = self._index.extended(env.__class__)
 
     def __getattr__(self, key):
-        for env in self._environments:
+        environments = self._environments
+        for position, check_dict in self._index.candidates(key):
+            env = environments[position]
+            if env.__class__ is LazyEnvironment:
+                env = environments[position] = env.factory(self)
+            elif check_dict and key not in env.__dict__:
+                continue
             try:
                 return getattr(env, key)
             except AttributeError:
@@ -62,7 +215,10 @@ class ExtendableEnvironment(object):
         raise AttributeError(key)
 
     def __repr__(self):
-        chain = '->'.join(env.__class__.__name__ for env in self._environments)
+        chain = '->'.join(
+            env.cls.__name__ + '?' if env.__class__ is LazyEnvironment
+            else env.__class__.__name__
+            for env in self._environments)
         return 'Env(%s)' % chain
 
 
@@ -72,18 +228,59 @@ class ConfigEnv(object):
     This environment is included by default on every request.
 
     '''
+    __slots__ = ('config',)
+
     def __init__(self, config):
         self.config = config
 
 
+class DeferEnv(object):
+    '''
+    Provides the :meth:`defer` method to run work after the response.
+    This environment is included by default on every request.
+
+    '''
+    __slots__ = ('_environ',)
+
+    def __init__(self, environ):
+        self._environ = environ
+
+    def defer(self, fn, *args, **kwargs):
+        '''
+        Run `fn(*args, **kwargs)` on the task pool of the :class:`Manager`
+        once the response has been sent. See :mod:`roots.tasks`.
+
+        Tasks must be deferred before the view returns.
+
+        '''
+        if 'roots.tasks' not in self._environ:
+            raise RootsConfigError(
+                "Tasks can only be deferred by a view served by a Manager, "
+                "before it returns.")
+        self._environ.setdefault('roots.deferred', []).append(
+            (fn, args, kwargs))
+
+
+# Process-wide cache of URLs built by `ReverseEnv`. It is cleared whenever the
+# routes of an app change.
+reverse_cache = LRUCache(4096)
+
+
 class ReverseEnv(object):
     '''
     Provides the :meth:'reverse' method to construct URLs.
     This environment is included by default on every request.
 
+    Built URLs are memoized in :data:`reverse_cache`, keyed by the endpoint,
+    the arguments and the parts of the request that affect the result (script
+    root, host, subdomain, scheme and method). URLs with unhashable arguments
+    are always built.
+
     :param map_adapter: App routes bound to WSGI environment.
 
     '''
+    __slots__ = ('_map_adapter',)
+
     def __init__(self, map_adapter):
         self._map_adapter = map_adapter
 
@@ -92,20 +289,186 @@ class ReverseEnv(object):
         Construct a URL.
 
         :param reversable:
-            A string, or an object with a `reversable_with` property.
+            A string, or an object with a `reversable_with` property. The
+            object may also have a `url_values` method, which is passed the
+            keyword arguments and returns the values to build the URL with.
 
         Additional keyword arugments will be passed into the URL builder to
         construct the URL.
 
         '''
-        if hasattr(reversable, 'reversable_with'):
-            return self._map_adapter.build(reversable.reversable_with, kwargs)
+        url_values = getattr(reversable, 'url_values', None)
+        if url_values is not None:
+            kwargs = url_values(kwargs)
+        return self._build(
+            getattr(reversable, 'reversable_with', reversable), kwargs)
 
-        return self._map_adapter.build(reversable, kwargs)
+    def reverse_many(self, reversable, kwargs_list):
+        '''
+        Construct a URL for each dictionary of arguments in `kwargs_list`.
+
+        :param reversable:
+            A string, or an object with a `reversable_with` property.
+
+        :returns: a list of URLs, in the same order as `kwargs_list`.
+
+        '''
+        endpoint = getattr(reversable, 'reversable_with', reversable)
+        url_values = getattr(reversable, 'url_values', None)
+        if url_values is not None:
+            kwargs_list = [url_values(kwargs) for kwargs in kwargs_list]
+        return [self._build(endpoint, kwargs) for kwargs in kwargs_list]
+
+    def _build(self, endpoint, kwargs):
+        map_adapter = self._map_adapter
+        try:
+            # Values of different types can be equal, such as 1, 1.0 and
+            # True, but build different URLs.
+            values = frozenset((name, type(value), value)
+                               for name, value in kwargs.iteritems())
+            key = (map_adapter.map, endpoint, values,
+                   map_adapter.script_name, map_adapter.server_name,
+                   map_adapter.subdomain, map_adapter.url_scheme,
+                   map_adapter.default_method)
+        except TypeError:
+            return map_adapter.build(endpoint, kwargs)
+
+        url = reverse_cache.get(key)
+        if url is None:
+            url = map_adapter.build(endpoint, kwargs)
+            reverse_cache.set(key, url)
+        return url
+
+
+# The sub-environments included in every request environment by default.
+DEFAULT_ENVIRONMENTS = (
+    LazyEnvironment(Request, lambda env: Request(env._environ),
+                    names=('environ', 'shallow')),
+    LazyEnvironment(ConfigEnv, lambda env: ConfigEnv(env._config)),
+    LazyEnvironment(ReverseEnv, lambda env: ReverseEnv(env._map_adapter)),
+    LazyEnvironment(DeferEnv, lambda env: DeferEnv(env._environ)),
+    )
+
+
+# Process-wide latency histograms of requests, by endpoint and phase. See
+# `App.handle_wsgi_request`.
+request_latency = LatencyHistograms()
 
 
 # Define the main 'App'.
 
+def _compression_policy(compress):
+    ''':returns: the `CompressionPolicy` for a `compress` option, or `None`.'''
+    if compress is True:
+        return CompressionPolicy()
+    return compress or None
+
+
+def _admission_limit(limit, name):
+    '''
+    :returns: the `Limit` for a `limit` option, named `name` unless it has
+        a name.
+
+    '''
+    if not isinstance(limit, Limit):
+        limit = Limit(concurrency=limit)
+    if limit.name is None:
+        limit.name = name
+    return limit
+
+
+def _mount_limits(limit, views, limits):
+    '''
+    :returns: the admission limits of `views` in an app they are mounted in
+        with `limit`, from their `limits` in the mounted app.
+
+    '''
+    if limit is None:
+        return limits
+    return dict((name, (limit,) + limits.get(name, ())) for name in views)
+
+
+def _renewed_cache(cache):
+    '''
+    :returns: an empty `LRUCache` the size of `cache`, keeping its counters
+        so they only ever increase.
+
+    '''
+    renewed = LRUCache(cache.maxsize)
+    renewed.hits = cache.hits
+    renewed.misses = cache.misses
+    renewed.evictions = cache.evictions
+    return renewed
+
+
+# Serializes changes to routes. Requests never take it.
+_routes_lock = RLock()
+
+
+def _derive_map(url_map, removed=(), added=()):
+    '''
+    :returns: a new :class:`werkzeug.routing.Map` with the rules of `url_map`
+        except those whose ids are in `removed`, plus the unbound rules in
+        `added`.
+
+    Existing rules are moved to the new map rather than copied, so only the
+    `added` rules are compiled. `url_map` is left untouched for requests
+    already using it. Rules only refer to their map for its settings, which
+    the maps share.
+
+    '''
+    new_map = Map(default_subdomain=url_map.default_subdomain,
+                  charset=url_map.charset,
+                  strict_slashes=url_map.strict_slashes,
+                  redirect_defaults=url_map.redirect_defaults,
+                  converters=url_map.converters,
+                  sort_parameters=url_map.sort_parameters,
+                  sort_key=url_map.sort_key,
+                  encoding_errors=url_map.encoding_errors,
+                  host_matching=url_map.host_matching)
+    rules = [rule for rule in url_map._rules if id(rule) not in removed]
+    for rule in rules:
+        rule.map = new_map
+    for rule in added:
+        rule.bind(new_map)
+        rules.append(rule)
+
+    new_map._rules = rules
+    for rule in rules:
+        new_map._rules_by_endpoint.setdefault(rule.endpoint, []).append(rule)
+    # Sort now, so requests never sort the map while it is in use.
+    new_map._remap = True
+    new_map.update()
+    return new_map
+
+
+class _Routing(object):
+    '''
+    A snapshot of the routes of an app and its mounted apps: the URL map, the
+    views by name, the admission limits by view name, and the compiled
+    dispatch table and match cache once they are built.
+
+    Each request uses the snapshot current when it started. Changing routes
+    replaces the app's snapshot rather than modifying it.
+
+    '''
+    __slots__ = ('map', 'view_lookup', 'limits', 'dispatch_table',
+                 'match_cache')
+
+    def __init__(self, url_map, view_lookup, limits):
+        self.map = url_map
+        self.view_lookup = view_lookup
+        # Name -> tuple of the `Limit`s admitting requests to the view,
+        # outermost mount first. Views without limits are left out.
+        self.limits = limits
+        self.dispatch_table = None
+        self.match_cache = None
+
+    def freeze(self):
+        self.dispatch_table = DispatchTable(self.map)
+        return self.dispatch_table
+
+
 class App(object):
     '''
     A thin wrapper around Werkzeug routing, intended for creating reusable,
@@ -116,16 +479,20 @@ class App(object):
     combined with a configuration. Apps can :meth:`mount` other apps with a URL
     path prefix.
 
+    Routes and mounted apps can be added and removed at any time, including
+    while serving. Changes to a mounted app are applied to the apps it is
+    mounted in. Each change builds a new snapshot of the routes, which
+    replaces the old one in a single step; requests in progress carry on
+    with the snapshot they started with.
+
     :param name: Name of the application (optional).
 
     '''
     def __init__(self, name=None):
-        # `App` is a wrapper around `werkzeug.routing.Map`
-        self._map = Map()
-
-        # Keep a dictionary of name -> view lookups. This will be updated
-        # whenever a new view is added or sub-app mounted.
-        self._view_lookup = {}
+        # The current `_Routing` snapshot, holding a `werkzeug.routing.Map`
+        # of the routes of this app and its mounted apps, and a dictionary
+        # of name -> view lookups.
+        self._routing = _Routing(Map(), {}, {})
 
         # The app name is used to give views a default lookup name.
         self.name = name
@@ -133,13 +500,45 @@ class App(object):
         # List of mounted sub apps.
         self.children = []
 
+        # This app's own rules, unbound, and its mounted apps and the apps
+        # it is mounted in, each with the path prefix of the mount. Parents
+        # also have the admission `Limit` of the mount, or `None`.
+        self._templates = []
+        self._mounts = []
+        self._parents = []
+
+        # The rule in `_routing.map` for each (template id, prefix) pair.
+        self._bound = {}
+
+        # Sub-environments added to the environment of every request.
+        self._environments = list(DEFAULT_ENVIRONMENTS)
+
+        # The compression policy of views routed without a `compress`
+        # option, and the names of those routed with one. See `compress`.
+        self.compression = None
+        self._compress_routed = set()
+
+    @property
+    def _map(self):
+        return self._routing.map
+
+    @property
+    def _view_lookup(self):
+        return self._routing.view_lookup
+
+    @property
+    def match_cache(self):
+        '''The LRU cache of match results, if enabled.'''
+        return self._routing.match_cache
+
     def default_name(self, fn):
         ''':returns: default reverse name for `fn`.'''
         if self.name:
             return "%s:%s" % (self.name, fn.__name__)
         return fn.__name__
 
-    def route(self, path, name=None, **kwargs):
+    def route(self, path, name=None, cache=None, compress=None,
+              coalesce=None, limit=None, **kwargs):
         '''
         Decorator to add a view to this app. The view function should take an
         environment as its first paramter and any additional keyword parameters
@@ -150,6 +549,26 @@ class App(object):
         :param name:
             A string used to reverse to this view. Default:
             'appname:functionname'.
+        :param cache:
+            Cache whole responses to `GET` and `HEAD` requests, skipping the
+            view and its environment while cached. Either a
+            :class:`roots.response_cache.CachePolicy` or a number of seconds
+            to cache for. See :mod:`roots.response_cache`.
+        :param compress:
+            Compress responses according to the `Accept-Encoding` header.
+            Either a :class:`roots.compression.CompressionPolicy`, `True` for
+            the default policy or `False` to not compress. Default: the
+            policy set with :meth:`compress`. See :mod:`roots.compression`.
+        :param coalesce:
+            Answer identical concurrent `GET` and `HEAD` requests with a
+            single run of the view. Either a
+            :class:`roots.coalescing.CoalescePolicy` or `True` for the
+            default policy. See :mod:`roots.coalescing`.
+        :param limit:
+            Limit the concurrency and rate of requests to the view, rejecting
+            those over the limit. Either a :class:`roots.admission.Limit` or
+            a maximum number of concurrent requests. See
+            :mod:`roots.admission`.
 
         See :class:`werkzeug.routing.Rule` for additional arguments.
 
@@ -161,26 +580,285 @@ class App(object):
         def _add_rule_decorator(fn):
             fn.reversable_with = name or self.default_name(fn)
 
-            if fn.reversable_with in self._view_lookup:
-                raise ReversableNameConflictError(fn.reversable_with)
-
-            rule = Rule(path, endpoint=fn.reversable_with, **kwargs)
-            self._map.add(rule)
-            self._view_lookup[fn.reversable_with] = fn
+            view = fn
+            if cache is not None:
+                policy = cache
+                if not isinstance(policy, CachePolicy):
+                    policy = CachePolicy(ttl=cache)
+                view = CachedView(fn, policy)
+
+            if compress is None:
+                view.compression = self.compression
+            else:
+                view.compression = _compression_policy(compress)
+
+            if coalesce is True:
+                view.coalescing = CoalescePolicy()
+            else:
+                view.coalescing = coalesce or None
+
+            limits = {}
+            if limit is not None:
+                limits[fn.reversable_with] = (
+                    _admission_limit(limit, fn.reversable_with),)
+
+            with _routes_lock:
+                self._check_names([fn.reversable_with])
+                template = Rule(path, endpoint=fn.reversable_with, **kwargs)
+                self._templates.append(template)
+                self._update_routing(added=[(template, '')],
+                                     views={fn.reversable_with: view},
+                                     limits=limits)
+                if compress is not None:
+                    self._compress_routed.add(fn.reversable_with)
             return fn
 
         return _add_rule_decorator
 
-    def mount(self, app, path):
-        '''Mount a child app under `path`.'''
-        # Check for reversable name conflicts.
-        for key in app._view_lookup.keys():
-            if key in self._view_lookup:
-                raise ReversableNameConflictError(key)
+    def remove_route(self, reversable):
+        '''
+        Remove a view added to this app with :meth:`route`.
+
+        :param reversable: The view, or the name it was routed with.
+
+        '''
+        name = getattr(reversable, 'reversable_with', reversable)
+        with _routes_lock:
+            templates = [template for template in self._templates
+                         if template.endpoint == name]
+            if not templates:
+                raise KeyError(name)
+            # Not `list.remove`: unbound rules all compare equal.
+            self._templates = [template for template in self._templates
+                               if template.endpoint != name]
+            self._compress_routed.discard(name)
+            self._update_routing(
+                removed=[(id(template), '') for template in templates],
+                removed_views=[name])
+
+    def mount(self, app, path, limit=None):
+        '''
+        Mount a child app under `path`.
+
+        :param limit: Limit the concurrency and rate of requests to the
+            child's routes, rejecting those over the limit, so they can't
+            hold up the other routes. Either a :class:`roots.admission.Limit`
+            or a maximum number of concurrent requests. See
+            :mod:`roots.admission`.
+
+        '''
+        prefix = path.rstrip('/')
+        if limit is not None:
+            limit = _admission_limit(limit, lambda: ', '.join(
+                (mounted + prefix) or '/'
+                for mounted in self._mounted_paths()))
+        with _routes_lock:
+            # Check for reversable name conflicts.
+            self._check_names(app._view_lookup.keys())
+
+            self._mounts.append((app, prefix))
+            self.children.append(app)
+            app._parents.append((self, prefix, limit))
+            views = app._view_lookup
+            self._update_routing(
+                added=[(template, prefix + template_prefix)
+                       for template, template_prefix
+                       in app._subtree_templates()],
+                views=views,
+                limits=_mount_limits(limit, views, app._routing.limits))
+
+            for ancestor in [self] + self._ancestors():
+                for env in app._environments:
+                    if env not in ancestor._environments:
+                        ancestor._environments.append(env)
+
+    def unmount(self, app):
+        '''
+        Remove a child app added with :meth:`mount`, along with its routes.
+        If it is mounted more than once, the first mount is removed.
+
+        Sub-environments added by the child are kept.
+
+        '''
+        with _routes_lock:
+            for mounted, prefix in self._mounts:
+                if mounted is app:
+                    break
+            else:
+                raise ValueError("%r is not mounted" % app)
+
+            self._mounts.remove((app, prefix))
+            self.children.remove(app)
+            for parent in app._parents:
+                if parent[:2] == (self, prefix):
+                    app._parents.remove(parent)
+                    break
+            self._update_routing(
+                removed=[(id(template), prefix + template_prefix)
+                         for template, template_prefix
+                         in app._subtree_templates()],
+                removed_views=app._view_lookup.keys())
+
+    def _subtree_templates(self):
+        '''
+        Iterate over the unbound rules of this app and its mounted apps, each
+        with the path prefix it is mounted under in this app.
+
+        '''
+        for template in self._templates:
+            yield template, ''
+        for app, prefix in self._mounts:
+            for template, template_prefix in app._subtree_templates():
+                yield template, prefix + template_prefix
+
+    def _ancestors(self):
+        ''':returns: a list of the apps this app is mounted in, recursively.'''
+        ancestors = []
+        for parent, prefix, limit in self._parents:
+            for app in [parent] + parent._ancestors():
+                if app not in ancestors:
+                    ancestors.append(app)
+        return ancestors
+
+    def _mounted_paths(self):
+        ''':returns: a list of the full paths this app is mounted under.'''
+        if not self._parents:
+            return ['']
+        paths = []
+        for parent, prefix, limit in self._parents:
+            for path in parent._mounted_paths():
+                if path + prefix not in paths:
+                    paths.append(path + prefix)
+        return paths
+
+    def _check_names(self, names):
+        for app in [self] + self._ancestors():
+            for name in names:
+                if name in app._view_lookup:
+                    raise ReversableNameConflictError(name)
+
+    def _update_routing(self, added=(), removed=(), views=None,
+                        removed_views=(), limits=None):
+        '''
+        Replace the routing snapshot of this app, and of the apps it is
+        mounted in, with one that has the changes applied.
+
+        :param added: (unbound rule, prefix) pairs to add.
+        :param removed: (unbound rule id, prefix) pairs to remove.
+        :param views: Dictionary of name -> view lookups to add.
+        :param removed_views: Names of views to remove.
+        :param limits: Dictionary of name -> admission limits of the added
+            views that have any.
+
+        '''
+        old = self._routing
+
+        removed_rules = set()
+        for key in removed:
+            rule = self._bound.pop(key, None)
+            if rule is not None:
+                removed_rules.add(id(rule))
+
+        added_rules = []
+        for template, prefix in added:
+            # Mount the rule as `Submount` would.
+            rule = template.empty()
+            rule.rule = prefix + rule.rule
+            self._bound[(id(template), prefix)] = rule
+            added_rules.append(rule)
+
+        if old.dispatch_table is None:
+            # No request has used this snapshot yet, as the first compiles
+            # it, so it can be changed in place. This keeps defining routes
+            # cheap.
+            url_map = old.map
+            if removed_rules:
+                url_map._rules = [rule for rule in url_map._rules
+                                  if id(rule) not in removed_rules]
+                url_map._rules_by_endpoint = {}
+                for rule in url_map._rules:
+                    url_map._rules_by_endpoint.setdefault(
+                        rule.endpoint, []).append(rule)
+            for rule in added_rules:
+                url_map.add(rule)
+            old.view_lookup.update(views or {})
+            old.limits.update(limits or {})
+            for name in removed_views:
+                old.view_lookup.pop(name, None)
+                old.limits.pop(name, None)
+        else:
+            view_lookup = dict(old.view_lookup)
+            view_lookup.update(views or {})
+            view_limits = dict(old.limits)
+            view_limits.update(limits or {})
+            for name in removed_views:
+                view_lookup.pop(name, None)
+                view_limits.pop(name, None)
+
+            routing = _Routing(
+                _derive_map(old.map, removed_rules, added_rules), view_lookup,
+                view_limits)
+            # Compile before swapping in, so requests never wait for it.
+            routing.freeze()
+            if old.match_cache is not None:
+                routing.match_cache = _renewed_cache(old.match_cache)
+            self._routing = routing
+        reverse_cache.clear()
+
+        for parent, prefix, limit in self._parents:
+            parent._update_routing(
+                [(template, prefix + template_prefix)
+                 for template, template_prefix in added],
+                [(template_id, prefix + template_prefix)
+                 for template_id, template_prefix in removed],
+                views, removed_views,
+                _mount_limits(limit, views or {}, limits or {}))
+
+    def compress(self, policy=True):
+        '''
+        Compress the responses of this app's views, including those already
+        routed, except views routed with a `compress` option. Mounted apps
+        are not affected.
+
+        :param policy: A :class:`roots.compression.CompressionPolicy`, `True`
+            for the default policy, or `False` to stop compressing.
+
+        '''
+        with _routes_lock:
+            self.compression = _compression_policy(policy)
+            for template in self._templates:
+                if template.endpoint not in self._compress_routed:
+                    view = self._view_lookup[template.endpoint]
+                    view.compression = self.compression
+
+    def extend_environment(self, env):
+        '''
+        Add a sub-environment to the environment of every request handled by
+        this app, or by an app it is mounted in. This is typically a
+        :class:`LazyEnvironment`, so that it is only constructed for views
+        that use it.
+
+        See :meth:`ExtendableEnvironment.extend_environment`.
+
+        '''
+        with _routes_lock:
+            for app in [self] + self._ancestors():
+                if env not in app._environments:
+                    app._environments.append(env)
+
+    def freeze(self):
+        '''
+        Compile this app's routes, including those of mounted apps, into a
+        :class:`roots.dispatch.DispatchTable` used to match requests.
+
+        This happens automatically on the first request, but can be called
+        up front to avoid the cost while serving. Once compiled, changing
+        the routes compiles a new table before it is used.
 
-        self._map.add(Submount(path, app._map._rules))
-        self._view_lookup.update(app._view_lookup)
-        self.children.append(app)
+        :returns: The compiled :class:`roots.dispatch.DispatchTable`.
+
+        '''
+        return self._routing.freeze()
 
     def app_iterator(self):
         '''Iterate over all descendant apps (inclusive) in tree order.'''
@@ -189,24 +867,146 @@ class App(object):
             for app in child.app_iterator():
                 yield app
 
+    def _match_cache_for(self, config, routing=None):
+        '''
+        :returns: the match cache sized by the `match_cache_size` option, or
+            `None` if the option is not set.
+
+        '''
+        size = config.get('match_cache_size')
+        if not size:
+            return None
+        routing = routing or self._routing
+        cache = routing.match_cache
+        if cache is None or cache.maxsize != size:
+            cache = routing.match_cache = LRUCache(size)
+        return cache
+
+    def _match(self, config, map_adapter, routing=None):
+        '''
+        Match the request bound to `map_adapter`. Successful matches are
+        cached by host, method and path when the match cache is enabled.
+
+        :param routing: The routing snapshot `map_adapter` was bound from.
+            Default: the current one.
+
+        :returns: a tuple of the endpoint, URL arguments and view function.
+
+        '''
+        routing = routing or self._routing
+        cache = self._match_cache_for(config, routing)
+        if cache is not None:
+            key = (map_adapter.server_name, map_adapter.subdomain,
+                   map_adapter.default_method, map_adapter.path_info)
+            match = cache.get(key)
+            if match is not None:
+                return match
+
+        dispatch_table = routing.dispatch_table or routing.freeze()
+        endpoint, kwargs = dispatch_table.match(map_adapter)
+        match = endpoint, kwargs, routing.view_lookup[endpoint]
+
+        if cache is not None:
+            cache.set(key, match)
+        return match
+
+    def _environment(self, environ, config, map_adapter):
+        # Create default environment. Sub-environments are constructed lazily.
+        env = ExtendableEnvironment(environ, config, map_adapter)
+        for sub_env in self._environments:
+            env.extend_environment(sub_env)
+        return env
+
     def handle_wsgi_request(self, config, environ, start_response):
-        # Bind the environment to the URL router.
-        map_adapter = self._map.bind_to_environ(environ)
+        '''
+        Handle a WSGI request with this app as the root.
+
+        Unless the `metrics` option is false, the latency of each matched
+        request is recorded in :data:`request_latency` by endpoint, split into
+        'routing', 'environment' (setup), 'view' and 'response' (iterating
+        the response body) phases.
+
+        '''
+        started = time()
+
+        # Bind the environment to the URL router. Changes to routes while
+        # the request is handled don't affect it.
+        routing = self._routing
+        map_adapter = routing.map.bind_to_environ(environ)
 
         # Lookup view.
         try:
-            endpoint, kwargs = map_adapter.match()
+            endpoint, kwargs, view_fn = self._match(config, map_adapter,
+                                                    routing)
         except HTTPException, e:
             return e(environ, start_response)
+        environ['roots.endpoint'] = endpoint
+        routed = time()
 
-        view_fn = self._view_lookup[endpoint]
+        # Admit the request by the limits of the route and its mounts, which
+        # are released once the response is closed.
+        limits = routing.limits.get(endpoint)
+        if limits:
+            rejection = admit(limits)
+            if rejection is not None:
+                return rejection(environ, start_response)
 
-        # Create default environment.
-        env = ExtendableEnvironment()
-        env.extend_environment(Request(environ))
-        env.extend_environment(ConfigEnv(config))
-        env.extend_environment(ReverseEnv(map_adapter))
-
-        # Call the view. This expects a valid WSGI app in response.
-        response = view_fn(env, **kwargs)
-        return response(environ, start_response)
+        try:
+            compressor = None
+            if getattr(view_fn, 'compression', None) is not None:
+                compressor = Compressor(view_fn.compression, endpoint, environ,
+                                        start_response)
+                start_response = compressor.start_response
+
+            coalescing = getattr(view_fn, 'coalescing', None)
+            cached = type(view_fn) is CachedView
+            if (cached or coalescing is not None) and \
+                    environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+                # The environment is only built if the response isn't cached
+                # or shared with an identical request.
+                view = view_fn.view if cached else view_fn
+
+                def _render(environ):
+                    env = self._environment(environ, config, map_adapter)
+                    return view(env, **kwargs)
+                if coalescing is not None:
+                    _render = coalesce(coalescing, endpoint, kwargs, _render)
+
+                prepared = routed
+                if cached:
+                    app_iter = view_fn.respond(endpoint, kwargs, environ,
+                                               start_response, _render)
+                else:
+                    app_iter = _render(environ)(environ, start_response)
+            else:
+                env = self._environment(environ, config, map_adapter)
+                prepared = time()
+
+                # Call the view. This expects a valid WSGI app in response.
+                response = view_fn(env, **kwargs)
+                app_iter = response(environ, start_response)
+
+            if compressor is not None:
+                app_iter = compressor.wrap(app_iter)
+        except BaseException:
+            if limits:
+                release(limits)
+            raise
+        if limits:
+            app_iter = release_after(app_iter, limits)
+
+        if not config.get('metrics', True):
+            return app_iter
+        finished = time()
+        request_latency.observe(endpoint, 'routing', routed - started)
+        request_latency.observe(endpoint, 'environment', prepared - routed)
+        request_latency.observe(endpoint, 'view', finished - prepared)
+
+        # Wrapping a file wrapper would stop the server from sending the file
+        # directly, so its response phase isn't recorded.
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and \
+                isinstance(app_iter, file_wrapper):
+            return app_iter
+        return close_after(app_iter, lambda: request_latency.observe(
+            endpoint, 'response', time() - finished))
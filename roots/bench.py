@@ -0,0 +1,192 @@
+'''
+In-process load benchmarks for a :class:`Manager`.
+
+Requests are synthesized for each rule in the app's map and driven through
+the manager as a WSGI application, without a server or sockets, so the
+figures measure the cost of Roots and the views themselves.
+
+'''
+import math
+import re
+from threading import Lock, Thread
+from time import time
+
+from werkzeug.routing import AnyConverter, ValidationError
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+
+# URL values tried, in order, for converters without a sample value.
+DEFAULT_SAMPLES = (u'1', u'1.0', u'sample')
+
+
+class SkipRule(Exception):
+    '''Raised when a request can't be synthesized for a rule.'''
+
+
+def _any_items(converter):
+    ''':returns: the items accepted by an :class:`AnyConverter`.'''
+    items = re.split(r'(?<!\\)\|', converter.regex[3:-1])
+    return [re.sub(r'\\(.)', r'\1', item) for item in items]
+
+
+def _url_value(converter, candidates):
+    '''
+    :returns: the Python value of the first of `candidates` that `converter`
+        accepts, or raises :class:`SkipRule`.
+
+    '''
+    for candidate in candidates:
+        if not re.match('^(?:%s)$' % converter.regex, candidate):
+            continue
+        try:
+            return converter.to_python(candidate)
+        except ValidationError:
+            pass
+    raise SkipRule()
+
+
+def sample_request(rule, samples=None):
+    '''
+    Synthesize a request for `rule`.
+
+    :param samples: A dictionary of URL values to use for converters, as
+        strings. Keys are either an argument name, used for every rule with
+        that argument, or 'endpoint.argument' for a single rule. Converters
+        without a sample try each of :data:`DEFAULT_SAMPLES`.
+
+    :returns: a tuple of the method and the path.
+
+    '''
+    samples = samples or {}
+    values = dict(rule.defaults or {})
+    for argument in rule.arguments:
+        if argument in values:
+            continue
+        converter = rule._converters[argument]
+        sample = samples.get('%s.%s' % (rule.endpoint, argument),
+                             samples.get(argument))
+        if sample is not None:
+            candidates = [unicode(sample)]
+        elif isinstance(converter, AnyConverter):
+            candidates = _any_items(converter)
+        else:
+            candidates = DEFAULT_SAMPLES
+        try:
+            values[argument] = _url_value(converter, candidates)
+        except SkipRule:
+            raise SkipRule("no valid sample for '%s'" % argument)
+
+    built = rule.build(values, append_unknown=False)
+    if built is None:
+        raise SkipRule("can't build URL")
+
+    methods = rule.methods or set(['GET'])
+    method = 'GET' if 'GET' in methods else sorted(methods)[0]
+    return method, built[1]
+
+
+def percentile(latencies, p):
+    ''':returns: the `p` th percentile of sorted `latencies`.'''
+    if not latencies:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(latencies)))
+    return latencies[max(0, min(len(latencies), rank) - 1)]
+
+
+def bench_request(app, method, path, requests=1000, concurrency=1,
+                  warmup=10):
+    '''
+    Send `requests` identical requests to the WSGI `app` from `concurrency`
+    threads, after `warmup` untimed requests. Response bodies are consumed
+    and closed, as a server would.
+
+    :returns: a dictionary of throughput, latency percentiles (in
+        milliseconds) and response status counts.
+
+    '''
+    statuses = {}
+    latencies = []
+    lock = Lock()
+    remaining = [requests]
+
+    def _send():
+        environ = EnvironBuilder(path=path, method=method).get_environ()
+        started = time()
+        try:
+            status = run_wsgi_app(app, environ, buffered=True)[1]
+            status = status.split(None, 1)[0]
+        except Exception, e:
+            status = e.__class__.__name__
+        return status, time() - started
+
+    def _worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            status, latency = _send()
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                latencies.append(latency)
+
+    for n in range(warmup):
+        _send()
+
+    started = time()
+    threads = [Thread(target=_worker) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items()
+                 if not status.isdigit() or int(status) >= 400)
+    return {
+        'method': method,
+        'path': path,
+        'requests': requests,
+        'errors': errors,
+        'statuses': statuses,
+        'requests_per_second': requests / (elapsed or 1e-9),
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        }
+
+
+def bench(manager, samples=None, endpoints=None, requests=1000,
+          concurrency=1, warmup=10, progress=None):
+    '''
+    Benchmark every rule of `manager.root`, one endpoint at a time.
+
+    :param samples: URL values for converters. See :func:`sample_request`.
+    :param endpoints: Only benchmark these endpoints.
+    :param progress: Optional function called with the endpoint and its
+        results as each finishes.
+
+    :returns: a dictionary with results by endpoint under `endpoints`, and
+        the reason each skipped endpoint was skipped under `skipped`.
+
+    '''
+    results = {'endpoints': {}, 'skipped': {}}
+    manager.root.freeze()
+    for rule in manager.root._map.iter_rules():
+        if endpoints and rule.endpoint not in endpoints:
+            continue
+        if rule.endpoint in results['endpoints']:
+            continue
+        try:
+            method, path = sample_request(rule, samples)
+        except SkipRule, e:
+            results['skipped'][rule.endpoint] = str(e)
+            continue
+        results['skipped'].pop(rule.endpoint, None)
+        result = bench_request(manager, method, path, requests, concurrency,
+                               warmup)
+        results['endpoints'][rule.endpoint] = result
+        if progress:
+            progress(rule.endpoint, result)
+    return results
@@ -0,0 +1,137 @@
+'''
+Coalescing of identical concurrent requests for views routed with the
+`coalesce` option of :meth:`App.route`.
+
+While a `GET` or `HEAD` request is running the view, identical requests
+wait for it to finish and are answered with a copy of its buffered
+response, instead of running the view again. Requests are identical when
+they have the same endpoint, URL arguments, query string and values of any
+headers the :class:`CoalescePolicy` varies on. Like the response cache,
+this assumes the response doesn't depend on anything else, such as cookies;
+vary on `Cookie` or `Authorization` for views that do.
+
+Responses with a `Set-Cookie` header are never shared; waiting requests run
+the view themselves instead, as they do if the running request takes longer
+than the policy's `timeout` or fails.
+
+Combined with the `cache` option, only requests missing the cache are
+coalesced, which stops a herd of requests rendering an expired response.
+
+'''
+from threading import Event, Lock
+
+from roots.response_cache import RequestKey, as_get, render_buffered
+
+
+class CoalescePolicy(RequestKey):
+    '''
+    How to coalesce the requests to a view.
+
+    :param timeout: Seconds to wait for a running request before running
+        the view anyway.
+    :param vary: Names of request headers whose values select different
+        responses, e.g. `('Accept-Language',)`.
+
+    '''
+    def __init__(self, timeout=10, vary=()):
+        super(CoalescePolicy, self).__init__(vary)
+        self.timeout = timeout
+
+
+class _Flight(object):
+    '''A running request that identical requests wait on.'''
+    __slots__ = ('done', 'result')
+
+    def __init__(self):
+        self.done = Event()
+        # The buffered (status, headers, body) once done, or `None` if the
+        # view failed.
+        self.result = None
+
+
+class _BufferedResponse(object):
+    '''A WSGI app sending a buffered response.'''
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def __call__(self, environ, start_response):
+        start_response(self.status, list(self.headers))
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return [self.body]
+
+
+# Requests running a coalesced view, by key.
+_flights = {}
+_lock = Lock()
+
+# Counters by endpoint: runs of the view, requests answered with the
+# response of another run ('coalesced', the number of runs saved), and
+# requests that gave up waiting for one.
+_counters = {}
+_COUNTERS = ('executions', 'coalesced', 'timeouts')
+
+
+def _count(endpoint, counter):
+    with _lock:
+        counters = _counters.get(endpoint)
+        if counters is None:
+            counters = _counters[endpoint] = dict.fromkeys(_COUNTERS, 0)
+        counters[counter] += 1
+
+
+def stats():
+    '''
+    :returns: a dictionary of endpoint -> counters of 'executions' of the
+        view, requests 'coalesced' into another's execution, and
+        'timeouts' waiting for one, after which the view is run again.
+
+    '''
+    with _lock:
+        return dict((endpoint, dict(counters))
+                    for endpoint, counters in _counters.items())
+
+
+def coalesce(policy, endpoint, kwargs, render):
+    '''
+    :returns: a function like `render`, which takes a WSGI environment and
+        returns a WSGI app, but which shares a single call of `render`
+        between identical concurrent requests.
+
+    '''
+    def _coalesced_render(environ):
+        key = policy.key(endpoint, kwargs, environ)
+        with _lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = _Flight()
+
+        if not leader:
+            if flight.done.wait(policy.timeout) and \
+                    flight.result is not None:
+                _count(endpoint, 'coalesced')
+                return _BufferedResponse(*flight.result)
+            if not flight.done.is_set():
+                _count(endpoint, 'timeouts')
+            _count(endpoint, 'executions')
+            return render(environ)
+
+        _count(endpoint, 'executions')
+        try:
+            # Render HEAD requests as GET, so the body can be shared.
+            status, headers, body = render_buffered(render, as_get(environ))
+            if not any(name.lower() == 'set-cookie'
+                       for name, value in headers):
+                flight.result = status, headers, body
+        finally:
+            with _lock:
+                del _flights[key]
+            flight.done.set()
+        return _BufferedResponse(status, headers, body)
+
+    return _coalesced_render
@@ -1,5 +1,3 @@
-import argparse
-import inspect
 from operator import attrgetter
 from functools import wraps
 
@@ -11,6 +9,10 @@ def _function_arg_parser(fn, ignore=[], arguments={}):
     Inspect a function's arguments and create an :mod:`argparse` parser.
 
     '''
+    # Imported here, as only the command being run needs a parser.
+    import argparse
+    import inspect
+
     parser = argparse.ArgumentParser(description=fn.__doc__)
     spec = inspect.getargspec(fn)
     defaults = dict(zip(reversed(spec.args or []),
@@ -60,19 +62,28 @@ def command(name=None, help=None, arguments={}):
         A dictionary mapping function arguments to parameters used in
         :meth:`ArgumentParser.add_argument`.
 
+    The parser is only built when the command is first run, so defining many
+    commands doesn't slow down starting the ones that are used.
+
     '''
     def _decorator(fn):
-        parser = _function_arg_parser(
-            fn, ignore=["manager"], arguments=arguments)
-
         @wraps(fn)
         def _command(manager, cmd_args):
-            namespace = parser.parse_args(cmd_args)
+            namespace = _command.parser().parse_args(cmd_args)
             return fn(manager, **vars(namespace))
 
+        def _parser():
+            if not parsers:
+                parser = _function_arg_parser(
+                    fn, ignore=["manager"], arguments=arguments)
+                parser.prog = _command.command_name
+                parsers.append(parser)
+            return parsers[0]
+
+        parsers = []
+        _command.parser = _parser
         _command.command_name = name or fn.__name__
         _command.command_help = help or fn.__doc__
-        parser.prog = _command.command_name
         return _command
     return _decorator
 
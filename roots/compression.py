@@ -0,0 +1,233 @@
+'''
+Compression of responses for views routed with the `compress` option of
+:meth:`App.route`, or on an app with :meth:`App.compress`.
+
+The encoding is negotiated from the `Accept-Encoding` header, preferring
+gzip to deflate. Bodies are compressed as they are iterated, so streamed
+responses are never buffered in full.
+
+Responses are sent as they are when their status isn't `200`, their content
+type isn't one of the policy's `types`, they already have a
+`Content-Encoding` or a `Cache-Control: no-transform` header, or their
+`Content-Length` is below the policy's `min_size`.
+
+The compressed bodies of cacheable responses, those with a strong `ETag`
+and without `Set-Cookie` or a private or `no-store` `Cache-Control`, are
+kept in :data:`compressed_cache`, so a hot response is only compressed once
+per encoding. Compressed responses have their `ETag` made weak, as their
+bytes differ from the original's.
+
+'''
+import zlib
+from itertools import chain
+
+from werkzeug.http import parse_accept_header
+
+from roots.utils.cache import LRUCache
+
+
+# Content types compressed by default.
+DEFAULT_TYPES = frozenset([
+        'application/javascript', 'application/json', 'application/xml',
+        'image/svg+xml', 'text/css', 'text/csv', 'text/html',
+        'text/javascript', 'text/plain', 'text/xml',
+        ])
+
+# zlib window bits selecting the container format of each encoding.
+_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+# Compressed bodies larger than this are not cached.
+_MAX_CACHED_BODY = 1024 * 1024
+
+
+class CompressionPolicy(object):
+    '''
+    How to compress the responses of a view.
+
+    :param min_size: Responses with a smaller `Content-Length` are sent
+        uncompressed. Responses without one are always compressed.
+    :param level: The zlib compression level, from 1 (fastest) to 9.
+    :param types: Content types to compress.
+    :param flush: Flush the compressor after every chunk of the body, for
+        streamed responses whose chunks must reach the client promptly.
+        Otherwise zlib holds small chunks back until it has a block.
+
+    '''
+    def __init__(self, min_size=512, level=6, types=DEFAULT_TYPES,
+                 flush=False):
+        self.min_size = min_size
+        self.level = level
+        self.types = frozenset(types)
+        self.flush = flush
+
+
+# Process-wide cache of compressed bodies, bounded to 16MB. Set
+# `compressed_cache.maxsize` to change the bound.
+compressed_cache = LRUCache(16 * 1024 * 1024, weigh=len)
+
+
+class _CompressedIterator(object):
+    '''
+    Wraps the iterable of a response, compressing it once the compressor
+    has decided to. Completed bodies are cached if the response allows it.
+
+    '''
+    def __init__(self, app_iter, compressor):
+        self._app_iter = app_iter
+        self._compressor = compressor
+
+    def __iter__(self):
+        # Apps may call `start_response` only once iterated, so the
+        # compressor decides after the first chunk.
+        chunks = iter(self._app_iter)
+        for first in chunks:
+            chunks = chain([first], chunks)
+            break
+
+        compressor = self._compressor
+        if compressor.coding is None:
+            for chunk in chunks:
+                yield chunk
+            return
+        if compressor.cached is not None:
+            yield compressor.cached
+            return
+
+        compressobj = compressor.compressobj
+        flush = compressor.policy.flush
+        key = compressor.cache_key
+        body = []
+        size = 0
+        for chunk in chunks:
+            data = compressobj.compress(chunk)
+            if flush:
+                data += compressobj.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                if key is not None:
+                    body.append(data)
+                    size += len(data)
+                    if size > _MAX_CACHED_BODY:
+                        key = None
+                        body = []
+                yield data
+        data = compressobj.flush()
+        if key is not None:
+            body.append(data)
+            compressed_cache.set(key, ''.join(body))
+        yield data
+
+    def close(self):
+        if hasattr(self._app_iter, 'close'):
+            self._app_iter.close()
+
+
+class Compressor(object):
+    '''
+    Compresses the response to one request according to `policy`.
+
+    Call the view's WSGI app with :meth:`start_response`, which decides
+    whether to compress from the response headers, then pass its iterable
+    to :meth:`wrap`.
+
+    :param policy: A :class:`CompressionPolicy`.
+    :param endpoint: The endpoint of the request, which keys cached bodies.
+
+    '''
+    def __init__(self, policy, endpoint, environ, start_response):
+        self.policy = policy
+        self.endpoint = endpoint
+        self.environ = environ
+        self._start_response = start_response
+        self.started = False
+        self.coding = None
+        self.compressobj = None
+        self.cache_key = None
+        self.cached = None
+
+    def start_response(self, status, headers, exc_info=None):
+        self.started = True
+        headers = self._negotiate(status, headers)
+        write = self._start_response(status, headers, exc_info)
+        if self.coding is None:
+            return write
+
+        def _write(data):
+            write(self.compressobj.compress(data) +
+                  self.compressobj.flush(zlib.Z_SYNC_FLUSH))
+        return _write
+
+    def _negotiate(self, status, headers):
+        ''':returns: the headers to send, having chosen the encoding.'''
+        self.coding = None
+        values = dict((name.lower(), value) for name, value in headers)
+        content_type = values.get('content-type', '')
+        if content_type.split(';')[0].strip().lower() not in \
+                self.policy.types:
+            return headers
+
+        headers = list(headers)
+        vary = values.get('vary')
+        if vary is None:
+            headers.append(('Vary', 'Accept-Encoding'))
+        elif 'accept-encoding' not in vary.lower():
+            headers = [(name, value) for name, value in headers
+                       if name.lower() != 'vary']
+            headers.append(('Vary', vary + ', Accept-Encoding'))
+
+        cache_control = values.get('cache-control', '').lower()
+        if not status.startswith('200') or 'content-encoding' in values or \
+                'no-transform' in cache_control:
+            return headers
+        length = values.get('content-length')
+        if length is not None and int(length) < self.policy.min_size:
+            return headers
+
+        # `Accept.best_match` doesn't honour `q=0`, so compare qualities.
+        # Ties go to gzip.
+        accept = parse_accept_header(
+            self.environ.get('HTTP_ACCEPT_ENCODING'))
+        quality, coding = max((accept[coding], coding)
+                              for coding in ('gzip', 'deflate'))
+        if quality <= 0:
+            return headers
+        self.coding = coding
+
+        etag = values.get('etag')
+        if etag is not None and not etag.startswith('W/') and \
+                'set-cookie' not in values and \
+                'no-store' not in cache_control and \
+                'private' not in cache_control:
+            # URLs of one endpoint may share an ETag, so key on the URL too.
+            environ = self.environ
+            self.cache_key = (self.endpoint,
+                              environ.get('SCRIPT_NAME', '') +
+                              environ.get('PATH_INFO', ''),
+                              environ.get('QUERY_STRING', ''),
+                              etag, coding, self.policy.level)
+            self.cached = compressed_cache.get(self.cache_key)
+
+        headers = [(name, value) for name, value in headers
+                   if name.lower() not in ('content-length', 'etag')]
+        headers.append(('Content-Encoding', coding))
+        if etag is not None:
+            headers.append(('ETag', etag if etag.startswith('W/')
+                            else 'W/' + etag))
+        if self.cached is not None:
+            headers.append(('Content-Length', str(len(self.cached))))
+        else:
+            self.compressobj = zlib.compressobj(
+                self.policy.level, zlib.DEFLATED, _WBITS[coding])
+        return headers
+
+    def wrap(self, app_iter):
+        ''':returns: the iterable to send for the response `app_iter`.'''
+        if self.environ['REQUEST_METHOD'] == 'HEAD':
+            return app_iter
+        if self.started and self.coding is None:
+            return app_iter
+        if self.cached is not None:
+            # The body was already compressed for an earlier request.
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            return [self.cached]
+        return _CompressedIterator(app_iter, self)
@@ -2,10 +2,16 @@ from roots.command import command
 from roots.utils.ansi import to_col, colour
 
 
-@command()
-def run(manager, host="localhost", port=8000, reloader=False):
+@command(arguments={
+        'port': {'type': int},
+        'workers': {'type': int},
+        'threads': {'type': int},
+        'backlog': {'type': int},
+        })
+def run(manager, host="localhost", port=8000, reloader=False, workers=1,
+        reuse_port=False, threads=0, backlog=64):
     '''Run a webserver.'''
-    manager.run(host, port, reloader)
+    manager.run(host, port, reloader, workers, reuse_port, threads, backlog)
 
 
 @command()
@@ -14,3 +20,115 @@ def routes(manager):
     for rule in manager.root._map.iter_rules():
         print (colour("1;32") + rule.endpoint + colour() +
                to_col(40) + rule.rule)
+
+
+@command(name="routes.cache", arguments={
+        'url': {'help': "The URL of a MetricsApp mounted in the running "
+                "server."},
+        })
+def routes_cache(manager, url=None):
+    '''Show route match cache statistics of a running server.'''
+    if not manager.config.get('match_cache_size'):
+        print "Match cache disabled. Set 'match_cache_size' to enable it."
+        return
+    if not url:
+        # This process hasn't served any requests, so has nothing to show.
+        print "Pass --url with the URL of a mounted MetricsApp."
+        return
+
+    import urllib2
+    from roots.metrics import parse_counter_text
+    text = urllib2.urlopen(url).read().decode('utf-8')
+    stats = {}
+    for name in ('roots_match_cache_total', 'roots_match_cache_entries'):
+        for labels, value in parse_counter_text(text, name).items():
+            labels = dict(labels)
+            key = labels.get('outcome') or labels.get('bound')
+            stats[key] = stats.get(key, 0) + int(value)
+    for key, value in sorted(stats.items()):
+        print colour("1;32") + key + colour() + to_col(40) + str(value)
+
+
+@command(arguments={
+        'sample': {'help': "URL value for a converter, as 'argument=value' "
+                   "or 'endpoint.argument=value'. May be repeated."},
+        'endpoint': {'help': "Only benchmark this endpoint. May be repeated."},
+        'requests': {'type': int},
+        'concurrency': {'type': int},
+        'warmup': {'type': int},
+        })
+def bench(manager, sample=[], endpoint=[], requests=1000, concurrency=1,
+          warmup=10, json=False):
+    '''Benchmark each route in-process, without a server.'''
+    from roots.bench import bench as run_bench
+
+    samples = dict(value.split('=', 1) for value in sample)
+
+    def _progress(endpoint, result):
+        print (colour("1;32") + endpoint + colour() + to_col(40) +
+               "%8.0f req/s  p50 %.2fms  p95 %.2fms  p99 %.2fms%s" % (
+                result['requests_per_second'], result['p50'],
+                result['p95'], result['p99'],
+                result['errors'] and "  %d errors" % result['errors'] or ""))
+
+    results = run_bench(manager, samples, endpoint, requests, concurrency,
+                        warmup, progress=None if json else _progress)
+
+    if json:
+        import json as _json
+        results['config'] = {
+            'requests': requests,
+            'concurrency': concurrency,
+            'warmup': warmup,
+            }
+        print _json.dumps(results, indent=2, sort_keys=True)
+        return
+
+    for endpoint, reason in sorted(results['skipped'].items()):
+        print (colour("1;33") + endpoint + colour() + to_col(40) +
+               "skipped: " + reason)
+
+
+@command(arguments={
+        'url': {'help': "Read the metrics of a running server from the URL "
+                "of a mounted MetricsApp, instead of this process."},
+        })
+def stats(manager, url=None):
+    '''Show request latency by endpoint and phase.'''
+    if url:
+        import urllib2
+        from roots.metrics import parse_prometheus_text
+        buckets, histograms = parse_prometheus_text(
+            urllib2.urlopen(url).read().decode('utf-8'))
+    else:
+        from roots.app import request_latency
+        buckets, histograms = request_latency.buckets, \
+            request_latency.snapshot()
+
+    from roots.utils.histogram import summarize
+    summary = summarize(buckets, histograms)
+    for endpoint in sorted(set(key[0] for key in summary)):
+        print colour("1;32") + str(endpoint) + colour()
+        for phase in ('routing', 'environment', 'view', 'response'):
+            phase_stats = summary.get((endpoint, phase))
+            if phase_stats is None:
+                continue
+            print ("  " + phase + to_col(20) +
+                   "%6d requests  mean %.2fms  p50 <%gms  p95 <%gms  "
+                   "p99 <%gms" % (
+                    phase_stats['count'], phase_stats['mean'] * 1000,
+                    phase_stats['p50'] * 1000, phase_stats['p95'] * 1000,
+                    phase_stats['p99'] * 1000))
+
+
+@command(name="profile.report", arguments={
+        'endpoint': {'help': "Only report endpoints matching this regular "
+                     "expression."},
+        'limit': {'type': int},
+        })
+def profile_report(manager, directory=None, endpoint=None, limit=20,
+                   merge=False):
+    '''Show the top cumulative hotspots of profiled requests.'''
+    from roots.profiling import report
+    report(directory or manager.config.get('profile_dir', 'profiles'),
+           endpoint, limit, merge)
@@ -0,0 +1,207 @@
+'''
+A precompiled dispatch table for matching requests against a
+:class:`werkzeug.routing.Map`.
+
+Werkzeug's :meth:`MapAdapter.match` tries every rule in the map in turn. The
+:class:`DispatchTable` narrows this down to the rules that could possibly match
+a path by indexing each rule on the static part of its URL. Rules with no
+converters are looked up directly by path, and rules with converters are
+stored in a trie keyed on the static path segments leading up to the first
+converter. Each index entry is split into per-method buckets.
+
+The candidate rules are then tried in the same order as the map would try
+them, so the first match is identical. Anything other than a plain match
+(not found, method not allowed, redirects) is handed back to the
+:class:`MapAdapter` so that the resulting exception is exactly the one
+Werkzeug would have raised.
+
+'''
+from werkzeug.routing import RequestSlash, RequestAliasRedirect
+
+
+class _Bucket(object):
+    '''
+    A set of rules indexed on the same key, split by HTTP method.
+
+    Each bucket holds the rules accepting that method plus any rules that can
+    raise a redirect before the method is checked, in map order.
+
+    '''
+    __slots__ = ('_rules', '_by_method', '_default')
+
+    def __init__(self):
+        self._rules = []
+        self._by_method = {}
+        self._default = ()
+
+    def add(self, index, rule, eager):
+        self._rules.append((index, rule, eager))
+
+    def finalize(self):
+        methods = set()
+        for index, rule, eager in self._rules:
+            methods.update(rule.methods or ())
+
+        def _accepting(method):
+            return tuple((index, rule) for index, rule, eager in self._rules
+                         if eager or rule.methods is None
+                         or method in rule.methods)
+
+        self._by_method = dict((method, _accepting(method))
+                               for method in methods)
+        self._default = _accepting(None)
+
+    def candidates(self, method):
+        return self._by_method.get(method, self._default)
+
+
+class _Node(object):
+    '''A node in the trie of static path segments.'''
+    __slots__ = ('children', 'bucket')
+
+    def __init__(self):
+        self.children = {}
+        self.bucket = None
+
+
+def _split_trace(rule):
+    '''
+    :returns: a tuple of the static path prefix of `rule` and a flag which is
+        true if the whole path is static.
+
+    '''
+    trace = rule._trace
+    start = trace.index((False, '|')) + 1
+    prefix = []
+    for is_dynamic, data in trace[start:]:
+        if is_dynamic:
+            return ''.join(prefix), False
+        prefix.append(data)
+    return ''.join(prefix), True
+
+
+def _static_keys(rule, path):
+    '''The paths a completely static rule could match.'''
+    if rule.is_leaf and rule.strict_slashes:
+        return [path]
+    base = path if rule.is_leaf else path[:-1]
+    return [base, base + '/']
+
+
+def _trie_segments(prefix):
+    '''The path segments of `prefix` which are followed by a slash.'''
+    return prefix.split('/')[1:-1]
+
+
+class DispatchTable(object):
+    '''
+    A compiled, read-only index over the rules of a
+    :class:`werkzeug.routing.Map`.
+
+    The table reflects the map at the time it was created and must be rebuilt
+    when rules are added.
+
+    :param url_map: The :class:`werkzeug.routing.Map` to compile.
+
+    '''
+    def __init__(self, url_map):
+        self._static = {}
+        self._root = _Node()
+
+        # Rules that need Werkzeug's redirect handling after a match.
+        self._redirecting = set()
+
+        buckets = []
+        for index, rule in enumerate(url_map.iter_rules()):
+            if rule.build_only:
+                continue
+
+            if rule.redirect_to is not None or (
+                    url_map.redirect_defaults and
+                    any(other.provides_defaults_for(rule)
+                        for other in url_map.iter_rules(rule.endpoint))):
+                self._redirecting.add(id(rule))
+
+            # Rules that may raise a redirect before their methods are
+            # checked are tried regardless of the request method.
+            eager = ((rule.strict_slashes and not rule.is_leaf) or
+                     (rule.alias and url_map.redirect_defaults))
+
+            prefix, is_static = _split_trace(rule)
+            if is_static:
+                for key in _static_keys(rule, prefix):
+                    bucket = self._static.get(key)
+                    if bucket is None:
+                        bucket = self._static[key] = _Bucket()
+                        buckets.append(bucket)
+                    bucket.add(index, rule, eager)
+            else:
+                node = self._root
+                for segment in _trie_segments(prefix):
+                    node = node.children.setdefault(segment, _Node())
+                if node.bucket is None:
+                    node.bucket = _Bucket()
+                    buckets.append(node.bucket)
+                node.bucket.add(index, rule, eager)
+
+        for bucket in buckets:
+            bucket.finalize()
+
+    def candidates(self, path, method):
+        '''
+        :returns: the rules that could match `path` with `method`, in map
+            order.
+
+        '''
+        found = []
+
+        bucket = self._static.get(path)
+        if bucket is not None:
+            found.append(bucket.candidates(method))
+
+        node = self._root
+        for segment in _trie_segments(path):
+            if node.bucket is not None:
+                found.append(node.bucket.candidates(method))
+            node = node.children.get(segment)
+            if node is None:
+                break
+        else:
+            if node.bucket is not None:
+                found.append(node.bucket.candidates(method))
+
+        found = [rules for rules in found if rules]
+        if len(found) == 1:
+            return found[0]
+        return sorted(rule for rules in found for rule in rules)
+
+    def match(self, map_adapter):
+        '''
+        Match the request bound to `map_adapter`. Behaves exactly like
+        :meth:`werkzeug.routing.MapAdapter.match` called with no arguments.
+
+        :returns: a tuple of the endpoint and the converted URL arguments.
+
+        '''
+        url_map = map_adapter.map
+        method = map_adapter.default_method.upper()
+        path = '/' + map_adapter.path_info.lstrip('/')
+        domain = (url_map.host_matching and map_adapter.server_name or
+                  map_adapter.subdomain)
+        full_path = u'%s|%s' % (domain, path)
+
+        for index, rule in self.candidates(path, method):
+            try:
+                rv = rule.match(full_path)
+            except (RequestSlash, RequestAliasRedirect):
+                return map_adapter.match()
+            if rv is None:
+                continue
+            if rule.methods is not None and method not in rule.methods:
+                continue
+            if id(rule) in self._redirecting:
+                return map_adapter.match()
+            return rule.endpoint, rv
+
+        # Let Werkzeug raise the appropriate NotFound or MethodNotAllowed.
+        return map_adapter.match()
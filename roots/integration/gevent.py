@@ -0,0 +1,94 @@
+'''
+Optional gevent integration for Roots.
+
+Serving a :class:`Manager` with gevent runs each request in a greenlet instead
+of a thread, so one process can hold thousands of concurrent slow or
+long-poll connections. Views remain plain functions receiving the usual
+:class:`ExtendableEnvironment`. Once the standard library is monkey patched,
+blocking socket I/O in a view yields to other requests.
+
+The standard library must be monkey patched before anything else is
+imported, at the top of the management script::
+
+    from gevent import monkey
+    monkey.patch_all()
+
+Roots creates locks as the app tree is built, such as those of admission
+limits, and locks created before patching would block every greenlet while
+waiting. :func:`make_server` refuses to serve if `threading` isn't patched.
+
+'''
+from __future__ import absolute_import
+
+from functools import wraps
+
+from gevent import get_hub, monkey
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from roots.app import RootsConfigError
+from roots.command import command
+
+
+def threaded(view):
+    '''
+    Decorator to run a view in gevent's thread pool, for views that block in
+    ways monkey patching can't help with (C extensions, CPU bound work). The
+    request's greenlet waits for the result without blocking other requests.
+
+    The pool is bounded; its size is set by the `threads` option of
+    :func:`serve`.
+
+    '''
+    @wraps(view)
+    def _view(env, *args, **kwargs):
+        return get_hub().threadpool.apply(view, (env,) + args, kwargs)
+    return _view
+
+
+def make_server(manager, host="localhost", port=8000, connections=1000,
+                threads=10):
+    '''
+    Create a gevent WSGI server for `manager`. The app tree is frozen first.
+
+    :param connections: Maximum number of requests handled concurrently.
+    :param threads: Size of the thread pool used by :func:`threaded` views.
+
+    :returns: An unstarted :class:`gevent.pywsgi.WSGIServer`.
+
+    :raises RootsConfigError: if `threading` isn't monkey patched.
+
+    '''
+    if not monkey.is_module_patched('threading'):
+        raise RootsConfigError(
+            "Serving with gevent needs the standard library to be monkey "
+            "patched: call gevent.monkey.patch_all() at the top of the "
+            "management script, before importing roots.")
+    manager.root.freeze()
+    get_hub().threadpool.maxsize = threads
+    return WSGIServer((host, port), manager, spawn=Pool(connections))
+
+
+def serve(manager, host="localhost", port=8000, connections=1000,
+          threads=10):
+    '''
+    Serve `manager` with gevent until interrupted, then wait for deferred
+    tasks. See :meth:`Manager.drain_tasks`.
+
+    '''
+    server = make_server(manager, host, port, connections, threads)
+    try:
+        server.serve_forever()
+    finally:
+        manager.drain_tasks()
+
+
+@command(name="gevent.run", arguments={
+        'port': {'type': int},
+        'connections': {'type': int},
+        'threads': {'type': int},
+        })
+def gevent_run(manager, host="localhost", port=8000, connections=1000,
+               threads=10):
+    '''Run a gevent webserver.'''
+    serve(manager, host, port, connections, threads)
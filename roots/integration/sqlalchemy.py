@@ -2,27 +2,671 @@
 Optional SQLAlchemy integration for Roots.
 
 '''
+from __future__ import absolute_import
+
+import csv
+import json
+import os
+import re
+from cStringIO import StringIO
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from functools import wraps
+from itertools import islice
+from threading import Lock, Thread
+from time import time
+
+from sqlalchemy import types
+from sqlalchemy.sql.expression import Select, UpdateBase
+from sqlalchemy.sql.util import find_tables
+from werkzeug.utils import escape
+from werkzeug.wrappers import BaseResponse, Response
+from werkzeug.wsgi import ClosingIterator
 
-from roots.app import App
+from roots.app import App, LazyEnvironment, RootsConfigError
 from roots.command import command
+from roots.metrics import counter_text, parse_counter_text, register_exporter
+from roots.utils.ansi import to_col, colour
+from roots.utils.cache import LRUCache
+
+
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_placeholder_list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_whitespace_re = re.compile(r"\s+")
+
+
+def normalize_statement(statement):
+    '''
+    Reduce SQL to its 'shape', replacing literal values with `?`, so that the
+    same query with different values normalizes to the same text.
+
+    '''
+    statement = _literal_re.sub('?', statement)
+    statement = _placeholder_list_re.sub('(?)', statement)
+    return _whitespace_re.sub(' ', statement).strip()
+
+
+class SQLStats(object):
+    '''
+    Process-wide counters for the connections used by views, in total and
+    per endpoint (the `reversable_with` name of the view).
+
+    '''
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = 0
+        self.statements = 0
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.endpoints = {}
+
+    def record_request(self, sql_env):
+        '''Add the counters of a finished :class:`SQLEnvironment`.'''
+        suspects = sql_env.n_plus_one()
+        duration = sum(query[1] for query in sql_env.queries)
+        with self._lock:
+            self.requests += 1
+            self.statements += sql_env.statement_count
+            if sql_env.checkout_wait is not None:
+                self.checkouts += 1
+                self.checkout_wait_total += sql_env.checkout_wait
+                self.checkout_wait_max = max(self.checkout_wait_max,
+                                             sql_env.checkout_wait)
+
+            endpoint = self.endpoints.get(sql_env.endpoint)
+            if endpoint is None:
+                endpoint = self.endpoints[sql_env.endpoint] = {
+                    'requests': 0,
+                    'statements': 0,
+                    'statements_max': 0,
+                    'duration': 0.0,
+                    'n_plus_one': {},
+                    }
+            endpoint['requests'] += 1
+            endpoint['statements'] += sql_env.statement_count
+            endpoint['statements_max'] = max(endpoint['statements_max'],
+                                             sql_env.statement_count)
+            endpoint['duration'] += duration
+            for statement, count in suspects:
+                n_plus_one = endpoint['n_plus_one']
+                n_plus_one[statement] = n_plus_one.get(statement, 0) + 1
+
+    def endpoint_stats(self):
+        ''':returns: a copy of the per-endpoint counters.'''
+        with self._lock:
+            return dict((name, dict(stats, n_plus_one=dict(
+                stats['n_plus_one'])))
+                for name, stats in self.endpoints.items())
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'statements': self.statements,
+                'checkouts': self.checkouts,
+                'checkout_wait_total': self.checkout_wait_total,
+                'checkout_wait_max': self.checkout_wait_max,
+                }
+
+
+sql_stats = SQLStats()
+
+
+class QueryCache(object):
+    '''
+    A process-wide cache of query results, used by
+    :meth:`SQLEnvironment.execute_cached`.
+
+    Entries expire after a TTL and are evicted least recently used first.
+    Each entry is tagged with the tables its query reads. Writing to a table
+    through :meth:`SQLEnvironment.execute` bumps that table's generation,
+    which invalidates every entry tagged with it. Writes whose table can't be
+    determined (such as textual SQL) invalidate everything.
+
+    Writes made by other processes are not seen, so the TTL bounds how stale
+    a result can be.
+
+    :param maxsize: Maximum number of cached results.
+
+    '''
+    def __init__(self, maxsize=1024):
+        self._entries = LRUCache(maxsize)
+        self._lock = Lock()
+        self._generations = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def snapshot(self, tables):
+        '''
+        :returns: the current generations of `tables`, to be taken before the
+            query runs and passed to :meth:`set`.
+
+        '''
+        with self._lock:
+            return self._generation, tuple(
+                (table, self._generations.get(table, 0)) for table in tables)
+
+    def _is_current(self, snapshot):
+        generation, tables = snapshot
+        return generation == self._generation and all(
+            self._generations.get(table, 0) == table_generation
+            for table, table_generation in tables)
+
+    def get(self, key):
+        ''':returns: the cached rows for `key`, or `None`.'''
+        entry = self._entries.get(key)
+        with self._lock:
+            if entry is not None:
+                expires, snapshot, rows = entry
+                if expires < time():
+                    self.expirations += 1
+                elif self._is_current(snapshot):
+                    self.hits += 1
+                    return rows
+                self._entries.discard(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, rows, snapshot, ttl):
+        self._entries.set(key, (time() + ttl, snapshot, rows))
+
+    def invalidate(self, tables):
+        '''
+        Invalidate entries that read any of `tables`. A table of `None`
+        invalidates every entry.
+
+        '''
+        with self._lock:
+            self.invalidations += 1
+            for table in tables:
+                if table is None:
+                    self._generation += 1
+                else:
+                    self._generations[table] = (
+                        self._generations.get(table, 0) + 1)
+
+    def clear(self):
+        self._entries.clear()
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self._entries.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self._entries.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                }
+
+
+query_cache = QueryCache()
+
+
+def _written_table(statement):
+    '''
+    :returns: the name of the table `statement` writes to, `None` if it may
+        write to any table, or `False` if it is a read.
+
+    '''
+    if isinstance(statement, Select):
+        return False
+    if isinstance(statement, UpdateBase):
+        return getattr(statement.table, 'fullname', None)
+    if unicode(statement).lstrip().lower().startswith('select'):
+        return False
+    return None
 
 
 class SQLEnvironment(object):
-    '''Environment Mixin with some SQLAlchemy helpers.'''
+    '''
+    Environment Mixin with some SQLAlchemy helpers.
+
+    A connection is checked out of the engine's pool the first time it is
+    needed, and used for every statement until :meth:`close` returns it. If
+    `transactional` is set, the connection runs in a transaction which
+    :meth:`close` commits or rolls back.
+
+    The time spent waiting for the connection is kept in
+    :attr:`checkout_wait` and the number of statements executed in
+    :attr:`statement_count`.
+
+    Results of :meth:`execute_cached` are kept in :data:`query_cache` for
+    `cache_ttl` seconds.
 
-    def __init__(self, engine):
+    Each statement is recorded in :attr:`queries` as a list of its
+    normalized SQL, duration in seconds and row count (`None` if the driver
+    doesn't report it). Statements of the same shape run at least
+    `n_plus_one_threshold` times are reported by :meth:`n_plus_one`.
+
+    '''
+    __slots__ = ('engine', 'transactional', 'cache_ttl', 'endpoint',
+                 'n_plus_one_threshold', 'statement_count', 'checkout_wait',
+                 'queries', '_connection', '_transaction', '_written')
+
+    def __init__(self, engine, transactional=False, cache_ttl=60,
+                 endpoint=None, n_plus_one_threshold=5):
         self.engine = engine
+        self.transactional = transactional
+        self.cache_ttl = cache_ttl
+        self.endpoint = endpoint
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.statement_count = 0
+        self.checkout_wait = None
+        self.queries = []
+        self._connection = None
+        self._transaction = None
+        self._written = set()
+
+    @property
+    def connection(self):
+        '''The request's connection, checked out on first use.'''
+        if self._connection is None:
+            started = time()
+            self._connection = self.engine.connect()
+            self.checkout_wait = time() - started
+            if self.transactional:
+                self._transaction = self._connection.begin()
+        return self._connection
+
+    def _record(self, result, started):
+        rows = result.rowcount
+        query = [normalize_statement(result.context.statement),
+                 time() - started, rows if rows >= 0 else None]
+        self.queries.append(query)
+        return query
+
+    def n_plus_one(self):
+        '''
+        :returns: a list of `(statement, count)` for statement shapes run at
+            least `n_plus_one_threshold` times, most frequent first.
+
+        '''
+        counts = {}
+        for query in self.queries:
+            counts[query[0]] = counts.get(query[0], 0) + 1
+        return sorted(((statement, count)
+                       for statement, count in counts.items()
+                       if count >= self.n_plus_one_threshold),
+                      key=lambda item: -item[1])
 
     def execute(self, *args, **kwargs):
-        return self.engine.execute(*args, **kwargs)
+        self.statement_count += 1
+        started = time()
+        result = self.connection.execute(*args, **kwargs)
+        self._record(result, started)
+
+        table = _written_table(args[0])
+        if table is not False:
+            self._written.add(table)
+            query_cache.invalidate([table])
+        return result
+
+    def execute_cached(self, query, *multiparams, **params):
+        '''
+        Execute a `select` query, using :data:`query_cache` to return the
+        result of an identical earlier query where possible. The cache is
+        keyed on the compiled SQL and bound parameters.
+
+        The time to keep the result can be given with the `ttl` keyword.
+        Queries other than `select` constructs are executed directly.
+
+        :returns: a list of rows.
+
+        '''
+        ttl = params.pop('ttl', self.cache_ttl)
+        key = self._cache_key(query, multiparams, params)
+
+        # Inside a transaction that has written, results may include
+        # uncommitted changes and must not be shared.
+        if key is None or (self.transactional and self._written):
+            return self.execute(query, *multiparams, **params).fetchall()
+
+        rows = query_cache.get(key)
+        if rows is None:
+            tables = set(table.fullname for table in find_tables(query))
+            snapshot = query_cache.snapshot(tables)
+            rows = self.execute(query, *multiparams, **params).fetchall()
+            self.queries[-1][2] = len(rows)
+            query_cache.set(key, rows, snapshot, ttl)
+        return list(rows)
+
+    def _cache_key(self, query, multiparams, params):
+        if not isinstance(query, Select) or len(multiparams) > 1:
+            return None
+        compiled = query.compile(bind=self.engine)
+        values = dict(compiled.params)
+        if multiparams:
+            if not isinstance(multiparams[0], dict):
+                return None
+            values.update(multiparams[0])
+        values.update(params)
+        try:
+            return self.engine, unicode(compiled), frozenset(values.items())
+        except TypeError:
+            return None
+
+    def stream_results(self, *args, **kwargs):
+        '''
+        Execute a query and iterate over its rows without loading them all
+        into memory. Rows are fetched `chunk_size` (keyword only, default
+        1000) at a time, using a server-side cursor where the database
+        supports one.
+
+        The query runs immediately; rows are fetched as the returned iterator
+        is consumed. Pass it to :func:`stream_rows` to send the rows as the
+        response body, which keeps the connection until the response has
+        been sent.
+
+        (This isn't called `stream`, which would be hidden by
+        :attr:`Request.stream` in the environment.)
+
+        '''
+        chunk_size = kwargs.pop('chunk_size', 1000)
+        self.statement_count += 1
+        connection = self.connection.execution_options(stream_results=True)
+        started = time()
+        result = connection.execute(*args, **kwargs)
+        return _iter_result(result, chunk_size, self._record(result, started))
+
+    def close(self, commit=True):
+        '''
+        Finish the transaction, if any, and return the connection to the
+        pool.
+
+        :param commit: Commit the transaction rather than rolling it back.
+
+        '''
+        if self._connection is None:
+            return
+        try:
+            if self._transaction is not None:
+                if commit:
+                    self._transaction.commit()
+                else:
+                    self._transaction.rollback()
+        finally:
+            self._connection.close()
+            self._connection = None
+            self._transaction = None
+            sql_stats.record_request(self)
+
+            # Results cached by other requests since the write may predate
+            # its commit (or rollback).
+            if self.transactional and self._written:
+                query_cache.invalidate(self._written)
+
+
+def _iter_result(result, chunk_size, query):
+    # `query` is the recorded statement, updated with the rows fetched.
+    query[2] = 0
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                return
+            query[2] += len(rows)
+            for row in rows:
+                yield row
+    finally:
+        result.close()
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _csv_chunks(rows):
+    buf = StringIO()
+    writer = csv.writer(buf)
+    header = True
+    for row in rows:
+        if header:
+            writer.writerow(row.keys())
+            header = False
+        writer.writerow([_encode(value) for value in row])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def _ndjson_chunks(rows):
+    for row in rows:
+        yield json.dumps(dict(row.items()), default=unicode) + '\n'
+
+
+def _html_chunks(rows, template):
+    for row in rows:
+        values = dict((key, escape(unicode(value)))
+                      for key, value in row.items())
+        yield _encode(template % values)
+
+
+def _buffered(chunks, buffer_size):
+    parts = []
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield ''.join(parts)
+
+
+_stream_formats = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'html': 'text/html',
+    }
+
+
+def stream_rows(rows, format='csv', template=None, buffer_size=8192,
+                mimetype=None, **kwargs):
+    '''
+    Create a response whose body is written as `rows` are iterated, so memory
+    use doesn't depend on the number of rows. Typically `rows` comes from
+    :meth:`SQLEnvironment.stream_results`.
+
+    :param format: One of `'csv'` (with a header row), `'ndjson'` (a JSON
+        object per line) or `'html'`.
+    :param template: For `'html'`, a format string applied to each row with
+        its HTML-escaped values, e.g. `'<li>%(name)s</li>'`.
+    :param buffer_size: Rows are collected into chunks of at least this many
+        bytes before being sent.
+    :param mimetype: Default: chosen from `format`.
+
+    Remaining keyword arguments are passed to :class:`Response`.
+
+    '''
+    if format == 'csv':
+        chunks = _csv_chunks(rows)
+    elif format == 'ndjson':
+        chunks = _ndjson_chunks(rows)
+    elif format == 'html':
+        chunks = _html_chunks(rows, template)
+    else:
+        raise ValueError("Unknown stream format: %s" % format)
+
+    return Response(_buffered(chunks, buffer_size),
+                    mimetype=mimetype or _stream_formats[format],
+                    direct_passthrough=True, **kwargs)
+
+
+def _close_all(sql_envs, commit):
+    '''Close each of `sql_envs`, raising the first error once all are.'''
+    error = None
+    for sql_env in sql_envs:
+        try:
+            sql_env.close(commit=commit)
+        except Exception, e:
+            error = error or e
+    if error is not None:
+        raise error
+
+
+def _close_after(iterable, sql_envs, succeeded):
+    '''
+    :returns: the response iterable `iterable`, wrapped to close `sql_envs`
+        once it is closed, including any first used while the body was
+        produced. Transactions are committed if `succeeded()` returns true
+        and the body was produced without errors.
+
+    '''
+    failed = []
+
+    def _tracked():
+        try:
+            for chunk in iterable:
+                yield chunk
+        except Exception:
+            failed.append(True)
+            raise
+
+    def _close():
+        try:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        finally:
+            _close_all(sql_envs, not failed and succeeded())
+
+    return ClosingIterator(_tracked(), _close)
+
+
+def _debug_header(sql_envs):
+    ''':returns: an `X-SQL-Stats` header summarising `sql_envs`.'''
+    statements = 0
+    duration = 0.0
+    n_plus_one = 0
+    for sql_env in sql_envs:
+        statements += sql_env.statement_count
+        duration += sum(query[1] for query in sql_env.queries)
+        n_plus_one += len(sql_env.n_plus_one())
+    return ('X-SQL-Stats', 'statements=%d; time=%.1fms; n+1=%d' % (
+        statements, duration * 1000, n_plus_one))
+
+
+class _SQLResponse(object):
+    '''
+    Wraps a WSGI app returned by a view, other than a :class:`Response`, to
+    close the :class:`SQLEnvironment`\ s of the request, `sql_envs`, once
+    its response has been sent.
+
+    If `debug` is set, an `X-SQL-Stats` header summarises the statements
+    run before the response started.
+
+    '''
+    def __init__(self, response, sql_envs, debug=False):
+        self._response = response
+        self._sql_envs = sql_envs
+        self._debug = debug
+
+    def __call__(self, environ, start_response):
+        status = []
+
+        def _start_response(status_line, headers, exc_info=None):
+            status.append(status_line)
+            if self._debug:
+                headers = list(headers) + [_debug_header(self._sql_envs)]
+            return start_response(status_line, headers, exc_info)
+
+        try:
+            app_iter = self._response(environ, _start_response)
+        except Exception:
+            _close_all(self._sql_envs, False)
+            raise
+
+        # The status may only be known once iteration has started.
+        return _close_after(app_iter, self._sql_envs,
+                            lambda: bool(status) and
+                            status[-1].startswith('2'))
+
+
+def _finish_response(response, sql_envs, debug):
+    '''
+    Arrange for `sql_envs` to be closed once `response`, a
+    :class:`Response`, has been sent.
+
+    :returns: `response` itself, so decorators applied outside
+        :func:`sql_environment` can still change it.
+
+    '''
+    if debug:
+        response.headers.add(*_debug_header(sql_envs))
+    if not response.is_streamed:
+        # A failed commit raises here, before anything is sent.
+        _close_all(sql_envs, 200 <= response.status_code < 300)
+    else:
+        # Wrap the body rather than use `call_on_close`, which isn't called
+        # for `direct_passthrough` responses.
+        response.response = _close_after(
+            response.response, sql_envs,
+            lambda: 200 <= response.status_code < 300)
+    return response
 
 
 def sql_environment(view):
+    '''
+    Decorator to provide a :class:`SQLEnvironment` to a view, using the
+    `engine` configuration option. The environment is only constructed if
+    the view uses it.
+
+    The connection is held until the response has been sent. Set the
+    `sql_transactional` option to run each request in a transaction that is
+    committed on a 2xx response and rolled back otherwise. The
+    `sql_cache_ttl` option sets the default lifetime of cached query results.
+
+    The transaction of a response whose body is in memory, such as a
+    :class:`Response` of a string, is committed when the view returns, so a
+    failed commit is sent as a `500`. The transaction of a streamed response
+    is committed once the body has been sent, after the status, so a failed
+    commit can't change the status the client got.
+
+    A :class:`Response` returned by the view is returned as it is, so
+    decorators applied outside this one can change it. Other WSGI apps are
+    wrapped.
+
+    Statements are recorded against the view's reverse name, with N+1
+    suspects flagged above the `sql_n_plus_one_threshold` option. If the
+    `sql_debug` option is set, responses get an `X-SQL-Stats` header.
+
+    '''
     @wraps(view)
     def _view(env, *args, **kwargs):
-        env.extend_environment(SQLEnvironment(env.config.engine))
-        return view(env, *args, **kwargs)
+        # Environments created by the view, or later by its response.
+        sql_envs = []
+
+        def _factory(env):
+            config = env.config
+            sql_env = SQLEnvironment(
+                config.engine,
+                config.get('sql_transactional', False),
+                config.get('sql_cache_ttl', 60),
+                getattr(_view, 'reversable_with', view.__name__),
+                config.get('sql_n_plus_one_threshold', 5))
+            sql_envs.append(sql_env)
+            return sql_env
+
+        env.extend_environment(LazyEnvironment(SQLEnvironment, _factory))
+        try:
+            response = view(env, *args, **kwargs)
+        except Exception:
+            _close_all(sql_envs, False)
+            raise
+
+        debug = env.config.get('sql_debug', False)
+        if isinstance(response, BaseResponse):
+            return _finish_response(response, sql_envs, debug)
+        return _SQLResponse(response, sql_envs, debug)
     return _view
 
 
@@ -58,3 +702,410 @@ def sql_reset(manager):
     for metadata in _all_metadata(manager.root):
         metadata.drop_all(engine)
         metadata.create_all(engine)
+
+
+def _read_rows(path):
+    '''
+    Iterate over the rows of a CSV file (with a header row) or an NDJSON file
+    as dictionaries. Empty CSV values are read as `None`.
+
+    '''
+    if path.endswith('.csv'):
+        with open(path, 'rb') as f:
+            for row in csv.DictReader(f):
+                yield dict((key, value.decode('utf-8') if value else None)
+                           for key, value in row.iteritems())
+    elif path.endswith(('.ndjson', '.jsonl')):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise RootsConfigError("Can't load %s: expected .csv or .ndjson"
+                               % path)
+
+
+_TRUE = frozenset(['1', 'true', 't', 'yes', 'y', 'on'])
+_FALSE = frozenset(['0', 'false', 'f', 'no', 'n', 'off'])
+
+
+def _strptime(value, formats, expected):
+    for format in formats:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError("expected %s" % expected)
+
+
+def _to_datetime(value):
+    value = value.replace('T', ' ').rstrip('Z')
+    return _strptime(value, ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f',
+                             '%Y-%m-%d %H:%M', '%Y-%m-%d'),
+                     'YYYY-MM-DDTHH:MM:SS')
+
+
+def _to_date(value):
+    return _strptime(value, ('%Y-%m-%d',), 'YYYY-MM-DD').date()
+
+
+def _to_time(value):
+    return _strptime(value, ('%H:%M:%S', '%H:%M:%S.%f', '%H:%M'),
+                     'HH:MM:SS').time()
+
+
+def _to_bool(value):
+    if value.lower() in _TRUE:
+        return True
+    if value.lower() in _FALSE:
+        return False
+    raise ValueError("expected true or false")
+
+
+def _to_decimal(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError("expected a number")
+
+
+def _coercer(column_type):
+    '''
+    :returns: a function converting a string to a value of `column_type`,
+        or `None` if strings can be inserted as they are.
+
+    '''
+    # DateTime isn't a Date, but check it first in case a dialect's is.
+    if isinstance(column_type, types.DateTime):
+        return _to_datetime
+    if isinstance(column_type, types.Date):
+        return _to_date
+    if isinstance(column_type, types.Time):
+        return _to_time
+    if isinstance(column_type, types.Boolean):
+        return _to_bool
+    if isinstance(column_type, types.Integer):
+        return int
+    if isinstance(column_type, types.Numeric):
+        return _to_decimal if column_type.asdecimal else float
+    return None
+
+
+def _coerce_rows(rows, table, path):
+    '''
+    Convert the string values of `rows`, read from `path`, to the types of
+    the columns of `table`. Other values, such as numbers in NDJSON, are
+    left as they are.
+
+    :raises RootsConfigError: naming the row and column of a value that
+        can't be converted.
+
+    '''
+    coercers = {}
+    for column in table.columns:
+        coercer = _coercer(column.type)
+        if coercer is not None:
+            coercers[column.name] = coercer
+
+    for number, row in enumerate(rows, 1):
+        for name, coercer in coercers.items():
+            value = row.get(name)
+            if isinstance(value, basestring):
+                try:
+                    row[name] = coercer(value.strip())
+                except ValueError, e:
+                    raise RootsConfigError(
+                        "%s, row %d, column '%s': can't load %r as %s (%s)"
+                        % (path, number, name, value,
+                           type(table.columns[name].type).__name__, e))
+        yield row
+
+
+def _dependency_levels(tables):
+    '''
+    Group `tables` into a list of levels, where each table only has foreign
+    keys to tables in earlier levels (or to tables not being loaded).
+
+    '''
+    levels = {}
+
+    def _level(table):
+        if table not in levels:
+            # Guard against cycles while this table's level is worked out.
+            levels[table] = 0
+            dependencies = [fk.column.table for fk in table.foreign_keys
+                            if fk.column.table in tables and
+                            fk.column.table is not table]
+            levels[table] = 1 + max(
+                [_level(dependency) for dependency in dependencies] or [-1])
+        return levels[table]
+
+    grouped = {}
+    for table in tables:
+        grouped.setdefault(_level(table), []).append(table)
+    return [grouped[level] for level in sorted(grouped)]
+
+
+class _LoadProgress(object):
+    '''Prints the progress of each table at most once per `interval`.'''
+
+    def __init__(self, interval=1.0):
+        self._lock = Lock()
+        self._interval = interval
+        self._reported = {}
+
+    def report(self, table, rows, elapsed, done=False):
+        now = time()
+        with self._lock:
+            reported = self._reported.get(table, 0)
+            if not done and now - reported < self._interval:
+                return
+            self._reported[table] = now
+            print (colour("1;32") + table + colour() + to_col(30) +
+                   "%d rows, %d rows/s%s" % (
+                    rows, rows / (elapsed or 1e-9), done and ", done" or ""))
+
+
+def load_table(engine, table, paths, batch_size=1000, progress=None):
+    '''
+    Insert the rows of the CSV or NDJSON files at `paths` into `table`, in
+    batches of `batch_size` rows. Each batch is inserted with `executemany`
+    in its own transaction.
+
+    Strings are converted to the type of their column: numbers, booleans
+    (`true`/`false`, `1`/`0`, `yes`/`no`), and ISO 8601 dates, times and
+    datetimes such as `2024-01-02` and `2024-01-02T03:04:05`.
+
+    :param progress: Optional :class:`_LoadProgress` to report to.
+
+    :returns: the number of rows inserted.
+
+    '''
+    total = 0
+    started = time()
+    connection = engine.connect()
+    try:
+        for path in paths:
+            rows = _coerce_rows(_read_rows(path), table, path)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                transaction = connection.begin()
+                try:
+                    connection.execute(table.insert(), batch)
+                    transaction.commit()
+                except Exception:
+                    transaction.rollback()
+                    raise
+                total += len(batch)
+                if progress:
+                    progress.report(table.fullname, total, time() - started)
+    finally:
+        connection.close()
+        query_cache.invalidate([table.fullname])
+
+    if progress:
+        progress.report(table.fullname, total, time() - started, done=True)
+    return total
+
+
+@command(name="sql.load", arguments={
+        'file': {'help': "A CSV or NDJSON file, loaded into the table named "
+                 "by its basename, or 'table=path'. May be repeated."},
+        'batch_size': {'type': int},
+        })
+def sql_load(manager, file=[], batch_size=1000, parallel=False):
+    '''Load CSV or NDJSON files into SQLAlchemy tables.'''
+    engine = manager.config['engine']
+    tables = {}
+    for metadata in _all_metadata(manager.root):
+        tables.update(metadata.tables)
+
+    paths = {}
+    for spec in file:
+        if '=' in spec:
+            name, path = spec.split('=', 1)
+        else:
+            path = spec
+            name = os.path.splitext(os.path.basename(path))[0]
+        if name not in tables:
+            raise RootsConfigError("No table named '%s'" % name)
+        paths.setdefault(tables[name], []).append(path)
+
+    progress = _LoadProgress()
+    started = time()
+    loaded = []
+
+    def _load(table):
+        loaded.append(load_table(engine, table, paths[table], batch_size,
+                                 progress))
+
+    # Tables in the same level don't reference each other, so with
+    # `parallel` each is loaded in its own thread. SQLite serializes
+    # writers, so this only helps with other databases.
+    for level in _dependency_levels(paths.keys()):
+        if not parallel:
+            for table in level:
+                _load(table)
+            continue
+
+        errors = []
+
+        def _load_thread(table):
+            try:
+                _load(table)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [Thread(target=_load_thread, args=(table,))
+                   for table in level]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    elapsed = time() - started
+    print "Loaded %d rows in %.1fs (%d rows/s)" % (
+        sum(loaded), elapsed, sum(loaded) / (elapsed or 1e-9))
+
+
+def sql_metrics_text():
+    '''
+    :returns: the counters of :data:`sql_stats`, in total and by endpoint,
+        and of :data:`query_cache` in the Prometheus text exposition format.
+        This is registered with :func:`roots.metrics.register_exporter`, so
+        a mounted :class:`roots.metrics.MetricsApp` exports them.
+
+    '''
+    stats = sql_stats.as_dict()
+    cache = query_cache.as_dict()
+    return (
+        counter_text('roots_sql_total', 'Requests that used a connection, '
+                     'statements executed, and connections checked out.',
+                     dict(((('counter', key),), stats[key]) for key in
+                          ('requests', 'statements', 'checkouts'))) +
+        counter_text('roots_sql_checkout_wait_seconds', 'Total and maximum '
+                     'time waited to check out a connection.',
+                     {(('value', 'total'),): stats['checkout_wait_total'],
+                      (('value', 'max'),): stats['checkout_wait_max']},
+                     'gauge') +
+        counter_text('roots_sql_query_cache_total', 'Query cache lookups '
+                     'and removals, by outcome.',
+                     dict(((('outcome', key),), cache[key])
+                          for key in ('hits', 'misses', 'evictions',
+                                      'expirations', 'invalidations'))) +
+        counter_text('roots_sql_query_cache_entries', 'Entries in the query '
+                     'cache, and its maximum size.',
+                     dict(((('bound', key),), cache[key])
+                          for key in ('size', 'maxsize')), 'gauge') +
+        _endpoint_metrics_text(sql_stats.endpoint_stats()))
+
+
+def _endpoint_metrics_text(endpoints):
+    totals = {}
+    maxima = {}
+    durations = {}
+    n_plus_one = {}
+    for name, stats in endpoints.items():
+        endpoint = ('endpoint', name)
+        for key in ('requests', 'statements'):
+            totals[endpoint, ('counter', key)] = stats[key]
+        maxima[(endpoint,)] = stats['statements_max']
+        durations[(endpoint,)] = stats['duration']
+        for statement, count in stats['n_plus_one'].items():
+            n_plus_one[endpoint, ('statement', statement)] = count
+    return (
+        counter_text('roots_sql_endpoint_total', 'Requests that used a '
+                     'connection, and statements executed, by endpoint.',
+                     totals) +
+        counter_text('roots_sql_endpoint_statements_max', 'Most statements '
+                     'executed by one request, by endpoint.', maxima,
+                     'gauge') +
+        counter_text('roots_sql_endpoint_duration_seconds_total', 'Time '
+                     'spent executing statements, by endpoint.', durations) +
+        counter_text('roots_sql_n_plus_one_total', 'Requests that ran a '
+                     'statement shape at least sql_n_plus_one_threshold '
+                     'times, by endpoint and statement.', n_plus_one))
+
+
+register_exporter(sql_metrics_text)
+
+
+def _read_sql_metrics(url):
+    '''
+    :returns: a tuple of the counters exported by :func:`sql_metrics_text`
+        from the MetricsApp at `url`, in the form of :meth:`SQLStats.as_dict`
+        with those of :meth:`QueryCache.as_dict` prefixed by 'cache\_', and
+        the per-endpoint counters in the form of
+        :meth:`SQLStats.endpoint_stats`.
+
+    '''
+    import urllib2
+    text = urllib2.urlopen(url).read().decode('utf-8')
+    stats = {}
+    for name, prefix in (('roots_sql_total', ''),
+                         ('roots_sql_checkout_wait_seconds', 'checkout_wait_'),
+                         ('roots_sql_query_cache_total', 'cache_'),
+                         ('roots_sql_query_cache_entries', 'cache_')):
+        for labels, value in parse_counter_text(text, name).items():
+            key = prefix + labels[0][1]
+            stats[key] = value if prefix == 'checkout_wait_' else int(value)
+
+    endpoints = {}
+
+    def _endpoint(labels):
+        name = dict(labels)['endpoint']
+        if name not in endpoints:
+            endpoints[name] = {'requests': 0, 'statements': 0,
+                               'statements_max': 0, 'duration': 0.0,
+                               'n_plus_one': {}}
+        return endpoints[name]
+
+    for labels, value in parse_counter_text(
+            text, 'roots_sql_endpoint_total').items():
+        _endpoint(labels)[dict(labels)['counter']] = int(value)
+    for labels, value in parse_counter_text(
+            text, 'roots_sql_endpoint_statements_max').items():
+        _endpoint(labels)['statements_max'] = int(value)
+    for labels, value in parse_counter_text(
+            text, 'roots_sql_endpoint_duration_seconds_total').items():
+        _endpoint(labels)['duration'] = value
+    for labels, value in parse_counter_text(
+            text, 'roots_sql_n_plus_one_total').items():
+        _endpoint(labels)['n_plus_one'][dict(labels)['statement']] = \
+            int(value)
+    return stats, endpoints
+
+
+@command(name="sql.stats", arguments={
+        'url': {'help': "The URL of a MetricsApp mounted in the running "
+                "server."},
+        })
+def sql_stats_command(manager, url=None):
+    '''Show SQL connection, query cache and endpoint statistics.'''
+    if not url:
+        # This process hasn't served any requests, so has nothing to show.
+        print "Pass --url with the URL of a mounted MetricsApp."
+        return
+
+    stats, endpoints = _read_sql_metrics(url)
+    for key, value in sorted(stats.items()):
+        print colour("1;32") + key + colour() + to_col(40) + str(value)
+
+    for name, endpoint in sorted(endpoints.items()):
+        if not endpoint['requests']:
+            continue
+        print
+        print colour("1;32") + name + colour()
+        print ("  requests %d, statements %.1f avg / %d max, %.1fms avg" % (
+            endpoint['requests'],
+            float(endpoint['statements']) / endpoint['requests'],
+            endpoint['statements_max'],
+            endpoint['duration'] * 1000 / endpoint['requests']))
+        for statement, count in sorted(endpoint['n_plus_one'].items(),
+                                       key=lambda item: -item[1]):
+            print colour("1;31") + "  N+1 in %d requests: " % count + \
+                colour() + statement
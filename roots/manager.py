@@ -1,8 +1,8 @@
 import sys
 
-from werkzeug.serving import run_simple
-
+from roots.app import RootsConfigError
 from roots.command import Commands
+from roots.tasks import pool_for
 from roots import default_commands
 
 
@@ -63,6 +63,14 @@ class Manager(object):
 
         self.commands.use_object(default_commands)
 
+        # The request profiler, or False once profiling is found to be off.
+        # See `roots.profiling`.
+        self._profiler = None
+
+        # The pool running tasks deferred by views, created on the first
+        # request. See `roots.tasks`.
+        self._task_pool = None
+
     def main(self):
         '''
         Handle command line input and run commands. If no command is specified,
@@ -99,11 +107,109 @@ class Manager(object):
 
         return command(self, args)
 
-    def run(self, host="localhost", port=8000, reloader=False):
-        '''Serve this :class:`Manager` using the Werkzeug server.'''
-        run_simple(host, port, application=self, use_reloader=reloader)
+    def run(self, host="localhost", port=8000, reloader=False, workers=1,
+            reuse_port=False, threads=0, backlog=64):
+        '''
+        Serve this :class:`Manager` using the Werkzeug server.
+
+        :param reloader: Restart the server when the source of a module used
+            by the app tree changes. See :mod:`roots.reloader`.
+        :param workers: If greater than one, serve from this many forked
+            worker processes with a :class:`roots.server.PreforkServer`. This
+            can't be combined with the reloader.
+        :param reuse_port: Bind each worker's socket with `SO_REUSEPORT`
+            instead of sharing one socket.
+        :param threads: If non-zero, handle requests on a fixed pool of this
+            many threads (in each worker). See
+            :class:`roots.server.ThreadPoolMixIn`.
+        :param backlog: Number of requests that may wait for a thread before
+            new ones are rejected with a `503`.
 
-    def __call__(self, environ, start_response):
-        '''Make this Manager object behave like a WSGI application.'''
+        '''
+        if workers > 1:
+            if reloader:
+                raise RootsConfigError(
+                    "The reloader can't be used with multiple workers.")
+            from roots.server import PreforkServer
+            PreforkServer(self, host, port, workers, reuse_port,
+                          threads, backlog).serve_forever()
+            return
+
+        # Imported here so that other commands start quickly.
+        from werkzeug.serving import run_simple
+
+        if threads:
+            from roots.server import make_thread_pool_server
+
+            def _serve():
+                self.root.freeze()
+                server = make_thread_pool_server(
+                    self, threads, backlog, host, port)
+                try:
+                    server.serve_forever()
+                finally:
+                    server.server_close()
+                    self.drain_tasks()
+        else:
+            def _serve():
+                try:
+                    run_simple(host, port, application=self)
+                finally:
+                    self.drain_tasks()
+
+        if reloader:
+            from roots.reloader import run_with_reloader
+            run_with_reloader(self, _serve)
+        else:
+            _serve()
+
+    def drain_tasks(self):
+        '''
+        Stop accepting deferred tasks, and wait for the queued ones to run
+        for up to the `task_drain_timeout` option (30 seconds by default).
+        Called when the server stops.
+
+        '''
+        if self._task_pool is not None:
+            self._task_pool.shutdown(self.config.get('task_drain_timeout', 30))
+
+    def _handle(self, environ, start_response):
         return self.root.handle_wsgi_request(
             self.config, environ, start_response)
+
+    def __call__(self, environ, start_response):
+        '''
+        Make this Manager object behave like a WSGI application.
+
+        If any of the `profile_*` options are set on the first request, a
+        sample of requests is profiled. See :mod:`roots.profiling`.
+
+        Tasks deferred by the view are queued once the response is closed.
+        See :mod:`roots.tasks`.
+
+        '''
+        profiler = self._profiler
+        if profiler is None:
+            profiler = self._profiler = self._make_profiler()
+        pool = self._task_pool
+        if pool is None:
+            pool = self._task_pool = pool_for(self)
+
+        environ['roots.tasks'] = pool
+        if profiler and profiler.should_profile(environ):
+            app_iter = profiler.profile(self._handle, environ, start_response)
+        else:
+            app_iter = self.root.handle_wsgi_request(
+                self.config, environ, start_response)
+        del environ['roots.tasks']
+
+        deferred = environ.pop('roots.deferred', None)
+        if deferred:
+            return pool.run_after(app_iter, deferred)
+        return app_iter
+
+    def _make_profiler(self):
+        if not any(key.startswith('profile_') for key in self.config):
+            return False
+        from roots.profiling import profiler_for
+        return profiler_for(self) or False
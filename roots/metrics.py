@@ -0,0 +1,286 @@
+'''
+Request metrics in the Prometheus text format.
+
+Mount a :class:`MetricsApp` to expose the latency histograms recorded by
+:meth:`App.handle_wsgi_request`, and other counters::
+
+    from roots.metrics import MetricsApp
+
+    app.mount(MetricsApp(), '/metrics')
+
+'''
+import re
+import weakref
+
+from werkzeug.wrappers import Response
+
+from roots import admission, coalescing
+from roots.app import App, request_latency
+
+
+# Servers whose stats are exported. See `register_server`.
+_servers = weakref.WeakSet()
+
+# Functions returning more metrics to export. See `register_exporter`.
+_exporters = []
+
+
+def register_server(server):
+    '''
+    Export the stats of `server`, a :class:`roots.server.ThreadPoolMixIn`
+    server, from :class:`MetricsApp`. Thread pool servers register
+    themselves when their pool starts.
+
+    '''
+    _servers.add(server)
+
+
+def register_exporter(exporter):
+    '''
+    Add the metrics returned by `exporter`, a function taking no arguments
+    and returning text in the Prometheus text exposition format, to those
+    exported by :class:`MetricsApp`. Integrations use this to export their
+    counters.
+
+    '''
+    if exporter not in _exporters:
+        _exporters.append(exporter)
+
+
+def _label(value):
+    return (unicode(value).replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def prometheus_text(histograms=request_latency,
+                    name='roots_request_duration_seconds'):
+    ''':returns: `histograms` in the Prometheus text exposition format.'''
+    lines = [
+        '# HELP %s Time spent handling requests, by endpoint and phase.'
+        % name,
+        '# TYPE %s histogram' % name,
+        ]
+    bounds = histograms.buckets + (float('inf'),)
+    for (endpoint, phase), histogram in sorted(
+            histograms.snapshot().items()):
+        labels = 'endpoint="%s",phase="%s"' % (_label(endpoint),
+                                                _label(phase))
+        cumulative = 0
+        for bound, count in zip(bounds, histogram):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (
+                name, labels, _number(bound), cumulative))
+        lines.append('%s_sum{%s} %s' % (name, labels, repr(histogram[-1])))
+        lines.append('%s_count{%s} %d' % (name, labels, cumulative))
+    return u'\n'.join(lines) + u'\n'
+
+
+def counter_text(name, help, counters, type='counter'):
+    '''
+    :returns: `counters` in the Prometheus text exposition format.
+
+    :param counters: A dictionary of label tuples, each a tuple of
+        `(label, value)` pairs, -> count.
+    :param type: The metric type, 'counter' or 'gauge'.
+
+    '''
+    lines = ['# HELP %s %s' % (name, help), '# TYPE %s %s' % (name, type)]
+    for labels, count in sorted(counters.items()):
+        lines.append('%s{%s} %s' % (name, ','.join(
+                    '%s="%s"' % (label, _label(value))
+                    for label, value in labels), _sample_value(count)))
+    return u'\n'.join(lines) + u'\n'
+
+
+def _sample_value(value):
+    if isinstance(value, float):
+        return _number(value)
+    return '%d' % value
+
+
+def match_cache_text(caches, name='roots_match_cache'):
+    '''
+    :returns: the counters of route match caches, such as
+        :attr:`App.match_cache`, in the Prometheus text exposition format.
+
+    :param caches: A dictionary of app name -> match cache.
+
+    '''
+    counters = {}
+    sizes = {}
+    for app, cache in caches.items():
+        stats = cache.stats()
+        for outcome in ('hits', 'misses', 'evictions'):
+            counters[('app', app), ('outcome', outcome)] = stats[outcome]
+        sizes[('app', app), ('bound', 'size')] = stats['size']
+        sizes[('app', app), ('bound', 'maxsize')] = stats['maxsize']
+    return (counter_text(name + '_total', 'Route match cache lookups, by '
+                         'root app and outcome.', counters) +
+            counter_text(name + '_entries', 'Entries in the route match '
+                         'cache, and its maximum size.', sizes, 'gauge'))
+
+
+def coalescing_text(name='roots_coalesced_requests_total'):
+    '''
+    :returns: the counters of :mod:`roots.coalescing` in the Prometheus
+        text exposition format.
+
+    '''
+    counters = {}
+    for endpoint, outcomes in coalescing.stats().items():
+        for outcome, count in outcomes.items():
+            counters[('endpoint', endpoint), ('outcome', outcome)] = count
+    return counter_text(
+        name, 'Requests to coalesced views, by endpoint and outcome: '
+        'executions of the view, coalesced into another execution, or '
+        'timeouts waiting for one.', counters)
+
+
+def admission_text(name='roots_admission_requests_total'):
+    '''
+    :returns: the counters of the limits of :mod:`roots.admission` in the
+        Prometheus text exposition format.
+
+    '''
+    counters = {}
+    for limit, outcomes in admission.stats().items():
+        for outcome in ('admitted', 'queued', 'rejected', 'rate_limited'):
+            counters[('limit', limit), ('outcome', outcome)] = \
+                outcomes[outcome]
+    return counter_text(
+        name, 'Requests checked against admission limits, by limit and '
+        'outcome: admitted, queued for a slot, rejected for concurrency, or '
+        'rate limited.', counters)
+
+
+def server_text(name='roots_server'):
+    '''
+    :returns: the stats of the registered servers in the Prometheus text
+        exposition format.
+
+    '''
+    gauges = {}
+    connections = {}
+    waits = {}
+    for server in list(_servers):
+        stats = server.stats()
+        label = ('server', '%s:%s' % server.server_address[:2])
+        for key in ('threads', 'backlog', 'queue_depth'):
+            gauges[label, ('value', key)] = stats[key]
+        for outcome in ('accepted', 'rejected', 'handled'):
+            connections[label, ('outcome', outcome)] = stats[outcome]
+        waits[label, ('value', 'total')] = stats['wait_total']
+        waits[label, ('value', 'max')] = stats['wait_max']
+    return (counter_text(name + '_pool', 'Threads of the server, the size '
+                         'of its queue of connections, and the number '
+                         'queued.', gauges, 'gauge') +
+            counter_text(name + '_connections_total', 'Connections '
+                         'accepted into the queue, rejected with a 503 as '
+                         'it was full, and handled by a thread.',
+                         connections) +
+            counter_text(name + '_queue_wait_seconds', 'Total and maximum '
+                         'time connections waited in the queue.', waits,
+                         'gauge'))
+
+
+_sample = re.compile(r'^(\w+)_(bucket|sum|count)\{(.*)\} (\S+)$')
+_labelled_sample = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+_label_pair = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _unlabel(value):
+    return re.sub(r'\\(.)', lambda m: m.group(1) == 'n' and '\n' or
+                  m.group(1), value)
+
+
+def parse_prometheus_text(text, name='roots_request_duration_seconds'):
+    '''
+    Parse the histograms written by :func:`prometheus_text`.
+
+    :returns: a tuple of the bucket bounds and a dictionary in the form of
+        :meth:`LatencyHistograms.snapshot`.
+
+    '''
+    cumulative = {}
+    sums = {}
+    for line in text.splitlines():
+        match = _sample.match(line)
+        if not match or match.group(1) != name:
+            continue
+        labels = dict((key, _unlabel(value))
+                      for key, value in _label_pair.findall(match.group(3)))
+        key = (labels.get('endpoint'), labels.get('phase'))
+        if match.group(2) == 'bucket':
+            cumulative.setdefault(key, {})[float(labels['le'])] = \
+                int(float(match.group(4)))
+        elif match.group(2) == 'sum':
+            sums[key] = float(match.group(4))
+
+    bounds = ()
+    histograms = {}
+    for key, buckets in cumulative.items():
+        bounds = sorted(buckets)
+        counts = [buckets[bound] for bound in bounds]
+        histograms[key] = ([counts[0]] +
+                           [b - a for a, b in zip(counts, counts[1:])] +
+                           [sums.get(key, 0.0)])
+    return tuple(bounds[:-1]), histograms
+
+
+def parse_counter_text(text, name):
+    '''
+    Parse the samples of the metric `name` written by :func:`counter_text`.
+
+    :returns: a dictionary of label dictionary items, as a sorted tuple of
+        `(label, value)` pairs, -> value.
+
+    '''
+    counters = {}
+    for line in text.splitlines():
+        match = _labelled_sample.match(line)
+        if not match or match.group(1) != name:
+            continue
+        labels = tuple(sorted(
+                (key, _unlabel(value))
+                for key, value in _label_pair.findall(match.group(2))))
+        counters[labels] = float(match.group(3))
+    return counters
+
+
+class MetricsApp(App):
+    '''
+    App that serves the request latency histograms, the counters of the
+    route match caches of the apps it is mounted in, of coalesced and
+    admitted requests, of the thread pool server, and of registered exporters,
+    in the Prometheus text format at its root.
+
+    '''
+    def __init__(self, name='metrics', histograms=request_latency):
+        super(MetricsApp, self).__init__(name)
+
+        @self.route('/')
+        def prometheus(env):
+            texts = [
+                prometheus_text(histograms),
+                match_cache_text(self._match_caches()),
+                coalescing_text(),
+                admission_text(),
+                server_text(),
+                ]
+            texts.extend(exporter() for exporter in _exporters)
+            return Response(u''.join(texts),
+                            content_type='text/plain; version=0.0.4')
+
+    def _match_caches(self):
+        ''':returns: the match caches of the root apps this is mounted in.'''
+        caches = {}
+        for app in [self] + self._ancestors():
+            if not app._parents and app.match_cache is not None:
+                caches[app.name or ''] = app.match_cache
+        return caches
@@ -0,0 +1,188 @@
+'''
+Sampling profiler for live requests.
+
+Profiling is opt-in, and enabled by setting any of these :class:`Manager`
+configuration options before the first request:
+
+`profile_every`
+    Profile one in every N requests.
+`profile_endpoints`
+    A regular expression. Only requests to matching endpoints are sampled,
+    all of them unless `profile_every` is also set. The request is matched
+    an extra time to find its endpoint, so this is cheapest with the match
+    cache enabled.
+`profile_header`
+    Always profile requests with this header, e.g. 'X-Roots-Profile'. Only
+    use this where clients are trusted.
+`profile_dir`
+    Directory for the results. Default: 'profiles'.
+
+Results are aggregated by endpoint into one pstats file per endpoint and
+process, which :func:`report` and the `profile.report` command merge.
+
+'''
+import cProfile
+import itertools
+import os
+import pstats
+import re
+import urllib
+from glob import glob
+from threading import Lock
+
+from werkzeug.exceptions import HTTPException
+
+from roots.utils.ansi import colour
+
+
+class _ProfiledIterator(object):
+    '''
+    Wraps the iterable of a profiled response, profiling its iteration and
+    recording the results once it is closed.
+
+    '''
+    def __init__(self, app_iter, profile, profiler, environ):
+        self._app_iter = app_iter
+        self._iterator = iter(app_iter)
+        self._profile = profile
+        self._profiler = profiler
+        self._environ = environ
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._profile.runcall(self._iterator.next)
+
+    def close(self):
+        try:
+            if hasattr(self._app_iter, 'close'):
+                self._profile.runcall(self._app_iter.close)
+        finally:
+            self._profiler.record(self._environ.get('roots.endpoint'),
+                                  self._profile)
+
+
+class RequestProfiler(object):
+    '''
+    Profiles a sample of the requests handled by a :class:`Manager` with
+    :mod:`cProfile`.
+
+    :param manager: The :class:`Manager` being profiled.
+    :param every: Profile one in every `every` requests.
+    :param endpoints: Only sample requests to endpoints matching this
+        regular expression.
+    :param header: Always profile requests with this header.
+    :param directory: Directory to write pstats files to.
+
+    '''
+    def __init__(self, manager, every=None, endpoints=None, header=None,
+                 directory='profiles'):
+        self.manager = manager
+        self.every = every
+        self.endpoints = endpoints and re.compile(endpoints)
+        self.directory = directory
+        self._header_key = header and \
+            'HTTP_' + header.upper().replace('-', '_')
+        self._counter = itertools.count()
+        self._lock = Lock()
+        self._stats = {}
+        self._pid = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def should_profile(self, environ):
+        ''':returns: whether to profile the request for `environ`.'''
+        if self._header_key is not None and self._header_key in environ:
+            return True
+        if not self.every and self.endpoints is None:
+            return False
+
+        if self.endpoints is not None:
+            root = self.manager.root
+            try:
+                endpoint = root._match(self.manager.config,
+                                       root._map.bind_to_environ(environ))[0]
+            except HTTPException:
+                return False
+            if not self.endpoints.search(endpoint):
+                return False
+
+        return not self.every or next(self._counter) % self.every == 0
+
+    def profile(self, app, environ, start_response):
+        '''
+        Call the WSGI `app` under the profiler. The results are recorded
+        when the response is closed.
+
+        '''
+        profile = cProfile.Profile()
+        app_iter = profile.runcall(app, environ, start_response)
+        return _ProfiledIterator(app_iter, profile, self, environ)
+
+    def path(self, endpoint):
+        ''':returns: the path of this process' pstats file for `endpoint`.'''
+        return os.path.join(self.directory, '%s.%d.pstats' % (
+            urllib.quote(endpoint, safe=''), os.getpid()))
+
+    def record(self, endpoint, profile):
+        '''Add `profile` to the results for `endpoint` and write them.'''
+        endpoint = endpoint or 'unmatched'
+        with self._lock:
+            # Results inherited from a parent process belong to its files.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stats = {}
+
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            stats.dump_stats(self.path(endpoint))
+
+
+def profiler_for(manager):
+    '''
+    :returns: a :class:`RequestProfiler` configured by the `profile_*`
+        options of `manager`, or `None` if profiling is not enabled.
+
+    '''
+    config = manager.config
+    options = dict((key, config.get('profile_' + key))
+                   for key in ('every', 'endpoints', 'header'))
+    if not any(options.values()):
+        return None
+    return RequestProfiler(manager,
+                           directory=config.get('profile_dir', 'profiles'),
+                           **options)
+
+
+def report(directory, endpoint=None, limit=20, merge=False):
+    '''
+    Print the top `limit` functions by cumulative time for each endpoint
+    profiled in `directory`, merging the files of every process.
+
+    :param endpoint: Only report endpoints matching this regular expression.
+    :param merge: Report all endpoints together.
+
+    '''
+    paths = {}
+    for path in glob(os.path.join(directory, '*.pstats')):
+        name = urllib.unquote(os.path.basename(path).rsplit('.', 2)[0])
+        if endpoint and not re.search(endpoint, name):
+            continue
+        paths.setdefault(name, []).append(path)
+
+    if not paths:
+        print "No profiles found in %s" % directory
+        return
+
+    if merge:
+        paths = {'all endpoints': sum(paths.values(), [])}
+
+    for name, endpoint_paths in sorted(paths.items()):
+        print colour("1;32") + name + colour()
+        stats = pstats.Stats(*endpoint_paths)
+        stats.sort_stats('cumulative').print_stats(limit)
@@ -0,0 +1,367 @@
+'''
+Reloader for the development server.
+
+The process started by `run --reloader` stays as a warm parent: it keeps
+every library it has imported and forks a child to serve. When a watched
+file changes, the child is stopped and a new one forked, which only has to
+re-import the project's own modules before serving again.
+
+Only the source files of project modules used by the mounted app tree are
+watched: the modules defining each app and view, and the modules they
+import, transitively. Modules of the standard library and installed
+packages are never watched. On Linux, changes are noticed with inotify, and
+otherwise by polling modification times. Bursts of changes, such as a
+checkout, restart the server once.
+
+'''
+import ctypes
+import ctypes.util
+import errno
+import os
+import runpy
+import select
+import signal
+import site
+import struct
+import sys
+import sysconfig
+import traceback
+import types
+from time import sleep, time
+
+from roots.response_cache import CachedView
+
+
+# Set in a child process to the file descriptor of the pipe its watched
+# files are reported to the parent on.
+_FD_ENV = 'ROOTS_RELOADER_FD'
+
+# inotify flags and event masks, from <sys/inotify.h>.
+_IN_CLOEXEC = 0o2000000
+_IN_MASK = (0x00000008 |  # IN_CLOSE_WRITE
+            0x00000040 |  # IN_MOVED_FROM
+            0x00000080 |  # IN_MOVED_TO
+            0x00000100 |  # IN_CREATE
+            0x00000200)   # IN_DELETE
+_EVENT = struct.Struct('iIII')
+
+_library_dirs = None
+
+
+def _is_library(path):
+    ''':returns: whether `path` is in the standard library or site-packages.'''
+    global _library_dirs
+    if _library_dirs is None:
+        paths = sysconfig.get_paths()
+        dirs = [paths[key] for key in ('stdlib', 'platstdlib', 'purelib',
+                                       'platlib') if key in paths]
+        dirs.extend(getattr(site, 'getsitepackages', lambda: [])())
+        if hasattr(site, 'getusersitepackages'):
+            dirs.append(site.getusersitepackages())
+        _library_dirs = tuple(set(os.path.join(os.path.realpath(d), '')
+                                  for d in dirs))
+    return os.path.realpath(path).startswith(_library_dirs)
+
+
+def _source_file(module):
+    ''':returns: the absolute path of the source of `module`, or `None`.'''
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    if not path.endswith('.py') or not os.path.isfile(path):
+        return None
+    return os.path.abspath(path)
+
+
+def _project_modules():
+    ''':returns: the names of imported modules that aren't libraries.'''
+    names = []
+    for name, module in sys.modules.items():
+        path = _source_file(module)
+        if path is not None and not _is_library(path):
+            names.append(name)
+    return names
+
+
+def watched_files(root):
+    '''
+    :returns: the set of source files of the project modules used by `root`
+        and the apps mounted in it.
+
+    These are the modules of the main script, each app's class and each
+    view, and the modules they refer to in their globals, transitively.
+
+    '''
+    pending = [sys.modules.get('__main__')]
+    for app in root.app_iterator():
+        pending.append(sys.modules.get(type(app).__module__))
+        for view in app._view_lookup.values():
+            if type(view) is CachedView:
+                view = view.view
+            pending.append(sys.modules.get(getattr(view, '__module__', '')))
+
+    seen = set()
+    files = set()
+    while pending:
+        module = pending.pop()
+        if module is None or id(module) in seen:
+            continue
+        seen.add(id(module))
+        path = _source_file(module)
+        if path is None or _is_library(path):
+            continue
+        files.add(path)
+
+        name = getattr(module, '__name__', '')
+        if '.' in name:
+            pending.append(sys.modules.get(name.rpartition('.')[0]))
+        for value in vars(module).values():
+            if isinstance(value, types.ModuleType):
+                pending.append(value)
+                continue
+            try:
+                module_name = getattr(value, '__module__', None)
+            except Exception:
+                # Proxies may fail to resolve outside a request.
+                continue
+            if isinstance(module_name, basestring):
+                pending.append(sys.modules.get(module_name))
+    return files
+
+
+class InotifyWatcher(object):
+    '''
+    Watches files for changes with Linux inotify, through `ctypes`.
+
+    The directories holding the files are watched rather than the files
+    themselves, so that files replaced by editors saving with a rename are
+    still noticed.
+
+    :raises OSError: or :class:`AttributeError` if inotify is unavailable.
+
+    '''
+    def __init__(self, paths=()):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self._fd = libc.inotify_init1(_IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = {}
+        self.paths = set()
+        self.watch(paths)
+
+    def watch(self, paths):
+        '''Also watch `paths`.'''
+        self.paths.update(paths)
+        watched = set(self._directories.values())
+        for directory in set(os.path.dirname(path) for path in paths):
+            if directory not in watched:
+                descriptor = self._add_watch(self._fd, directory, _IN_MASK)
+                if descriptor >= 0:
+                    self._directories[descriptor] = directory
+
+    def wait(self, timeout=None):
+        '''
+        Wait up to `timeout` seconds, or indefinitely, for events.
+
+        :returns: the set of watched paths that changed, which is empty if
+            there were no events for watched paths.
+
+        '''
+        try:
+            if not select.select([self._fd], [], [], timeout)[0]:
+                return set()
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return set()
+            raise
+        data = os.read(self._fd, 64 * 1024)
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            path = os.path.join(self._directories.get(descriptor, ''), name)
+            if path in self.paths:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class StatWatcher(object):
+    '''
+    Watches files for changes by polling their modification times every
+    `interval` seconds.
+
+    '''
+    def __init__(self, paths=(), interval=1):
+        self.interval = interval
+        self._mtimes = {}
+        self.watch(paths)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def watch(self, paths):
+        '''Also watch `paths`.'''
+        for path in paths:
+            if path not in self._mtimes:
+                self._mtimes[path] = self._mtime(path)
+
+    def wait(self, timeout=None):
+        '''See :meth:`InotifyWatcher.wait`.'''
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            changed = set()
+            for path, mtime in self._mtimes.items():
+                current = self._mtime(path)
+                if current != mtime:
+                    self._mtimes[path] = current
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is None:
+                sleep(self.interval)
+            elif time() >= deadline:
+                return changed
+            else:
+                sleep(min(self.interval, deadline - time()))
+
+    def close(self):
+        pass
+
+
+def make_watcher(paths=(), interval=1):
+    '''
+    :returns: an :class:`InotifyWatcher` if possible, or a
+        :class:`StatWatcher` polling every `interval` seconds.
+
+    '''
+    try:
+        return InotifyWatcher(paths)
+    except (OSError, AttributeError):
+        return StatWatcher(paths, interval)
+
+
+def _spawn(modules):
+    '''
+    Fork a child which forgets the project `modules` and runs the main
+    script again, and wait for it to report its watched files.
+
+    :returns: a tuple of the child's pid and its watched files.
+
+    '''
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        code = 1
+        try:
+            # Keep the forgotten modules alive, as Python clears the globals
+            # of collected modules and this one is among them.
+            forgotten = [sys.modules.pop(name, None) for name in modules]
+            os.environ[_FD_ENV] = str(write_fd)
+            runpy.run_path(sys.argv[0], run_name='__main__')
+            code = 0
+        except SystemExit, e:
+            code = e.code if isinstance(e.code, int) else int(bool(e.code))
+        except KeyboardInterrupt:
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    os.close(write_fd)
+    data = []
+    try:
+        while True:
+            chunk = os.read(read_fd, 64 * 1024)
+            if not chunk:
+                break
+            data.append(chunk)
+    finally:
+        os.close(read_fd)
+    return pid, [path for path in ''.join(data).split('\n') if path]
+
+
+def _stop(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+
+
+def run_with_reloader(manager, serve, debounce=0.1, interval=1):
+    '''
+    Call `serve` in a child process, forking a new one whenever a file
+    watched for `manager`'s app tree changes.
+
+    The child runs the main script again to rebuild the app tree, and calls
+    this function again, which then serves. Where `os.fork` isn't available,
+    Werkzeug's reloader is used instead.
+
+    :param debounce: Seconds without further changes to wait for before
+        restarting.
+    :param interval: Seconds between polls, when inotify is unavailable.
+
+    '''
+    fd = os.environ.pop(_FD_ENV, None)
+    if fd is not None:
+        # In a child: report the files to watch, then serve.
+        with os.fdopen(int(fd), 'w') as report:
+            report.write('\n'.join(watched_files(manager.root)))
+        serve()
+        return
+
+    if not hasattr(os, 'fork'):
+        from werkzeug.serving import run_with_reloader
+        run_with_reloader(serve, interval=interval)
+        return
+
+    modules = _project_modules()
+    watcher = make_watcher(watched_files(manager.root), interval)
+    print " * Watching for changes with %s" % type(watcher).__name__
+    pid = None
+    try:
+        while True:
+            started = time()
+            pid, paths = _spawn(modules)
+            watcher.watch(paths)
+            print " * Loaded app in %.0fms" % ((time() - started) * 1000)
+
+            changed = set()
+            while not changed:
+                changed = watcher.wait()
+            while True:
+                more = watcher.wait(debounce)
+                if not more:
+                    break
+                changed |= more
+
+            print " * Detected change in %s, restarting" % ', '.join(
+                sorted(os.path.relpath(path) for path in changed))
+            _stop(pid)
+            pid = None
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pid is not None:
+            _stop(pid)
+        watcher.close()
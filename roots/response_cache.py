@@ -0,0 +1,193 @@
+'''
+Caching of whole responses for views routed with the `cache` option of
+:meth:`App.route`.
+
+Cached responses are served without calling the view or building its
+environment. Every cached response has an `ETag`, generated from the body
+if the view didn't set one, and requests with a matching `If-None-Match`
+header are answered with `304 Not Modified`.
+
+Only `200` responses to `GET` and `HEAD` requests without a `Set-Cookie`
+header or a private or `no-store` `Cache-Control` are cached. Entries are keyed by endpoint, URL arguments, query
+string and any headers the :class:`CachePolicy` varies on.
+
+'''
+from time import time
+
+from werkzeug.http import generate_etag, parse_etags, quote_etag, \
+    unquote_etag
+
+from roots.utils.cache import LRUCache
+
+
+# Headers kept in `304 Not Modified` responses.
+_NOT_MODIFIED_HEADERS = frozenset(['cache-control', 'content-location',
+                                   'date', 'etag', 'expires', 'vary'])
+
+
+class RequestKey(object):
+    '''
+    Identifies requests for the same response by their endpoint, URL
+    arguments, query string and the values of the `vary` headers.
+
+    :param vary: Names of request headers whose values select different
+        responses, e.g. `('Accept-Language',)`.
+
+    '''
+    def __init__(self, vary=()):
+        self.vary = tuple(vary)
+        self._vary_keys = tuple('HTTP_' + header.upper().replace('-', '_')
+                                for header in self.vary)
+
+    def key(self, endpoint, kwargs, environ):
+        return (endpoint, frozenset(kwargs.iteritems()),
+                environ.get('QUERY_STRING', ''),
+                tuple(environ.get(key) for key in self._vary_keys))
+
+
+class CachePolicy(RequestKey):
+    '''
+    How to cache the responses of a view.
+
+    :param ttl: Seconds to keep a response for.
+    :param vary: Names of request headers whose values select different
+        responses, e.g. `('Accept-Language',)`.
+
+    '''
+    def __init__(self, ttl=60, vary=()):
+        super(CachePolicy, self).__init__(vary)
+        self.ttl = ttl
+
+
+class _CachedResponse(object):
+    __slots__ = ('status', 'headers', 'body', 'etag', 'expires')
+
+    def __init__(self, status, headers, body, etag, expires):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+
+
+def _weigh(entry):
+    # Approximate memory used by an entry, in bytes.
+    return (len(entry.body) + 256 +
+            sum(len(name) + len(value) for name, value in entry.headers))
+
+
+# Process-wide cache of responses, bounded to 32MB of bodies and headers.
+# Set `response_cache.maxsize` to change the bound.
+response_cache = LRUCache(32 * 1024 * 1024, weigh=_weigh)
+
+
+def _not_modified(environ, etag):
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    return bool(if_none_match) and \
+        parse_etags(if_none_match).contains_weak(unquote_etag(etag)[0])
+
+
+def _respond(entry, environ, start_response):
+    if _not_modified(environ, entry.etag):
+        start_response('304 Not Modified', [
+                (name, value) for name, value in entry.headers
+                if name.lower() in _NOT_MODIFIED_HEADERS])
+        return []
+    start_response(entry.status, list(entry.headers))
+    if environ['REQUEST_METHOD'] == 'HEAD':
+        return []
+    return [entry.body]
+
+
+def as_get(environ):
+    '''
+    :returns: a copy of `environ` for a `GET` request, which shares the
+        list of tasks deferred by the view with `environ`, so they are run
+        by the :class:`Manager`. See :meth:`DeferEnv.defer`.
+
+    '''
+    environ.setdefault('roots.deferred', [])
+    return dict(environ, REQUEST_METHOD='GET')
+
+
+def render_buffered(render, environ):
+    '''
+    Render a response with `render` and buffer it.
+
+    :returns: a tuple of the status, headers and body.
+
+    '''
+    captured = []
+    body = []
+
+    def _start_response(status, headers, exc_info=None):
+        captured[:] = [status, headers]
+        return body.append
+
+    app_iter = render(environ)(environ, _start_response)
+    try:
+        for chunk in app_iter:
+            body.append(chunk)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    return captured[0], list(captured[1]), ''.join(body)
+
+
+class CachedView(object):
+    '''
+    A view routed with a :class:`CachePolicy`. Called directly, as for
+    requests that aren't cacheable, it calls the view as usual.
+
+    '''
+    def __init__(self, view, policy):
+        self.view = view
+        self.policy = policy
+
+    def __call__(self, env, **kwargs):
+        return self.view(env, **kwargs)
+
+    def respond(self, endpoint, kwargs, environ, start_response, render):
+        '''
+        Answer a `GET` or `HEAD` request from the cache, or with the
+        response of `render(environ)`, caching it if possible.
+
+        '''
+        key = self.policy.key(endpoint, kwargs, environ)
+        entry = response_cache.get(key)
+        if entry is not None and entry.expires > time():
+            return _respond(entry, environ, start_response)
+
+        # Render HEAD requests as GET, so the body can be cached.
+        status, headers, body = render_buffered(render, as_get(environ))
+
+        names = set(name.lower() for name, value in headers)
+        cache_control = ', '.join(value for name, value in headers
+                                  if name.lower() == 'cache-control').lower()
+        if not status.startswith('200') or 'set-cookie' in names or \
+                'no-store' in cache_control or 'private' in cache_control:
+            start_response(status, headers)
+            return [] if environ['REQUEST_METHOD'] == 'HEAD' else [body]
+
+        if 'etag' not in names:
+            headers.append(('ETag', quote_etag(generate_etag(body))))
+        etag = [value for name, value in headers
+                if name.lower() == 'etag'][0]
+        entry = _CachedResponse(status, headers, body, etag,
+                                time() + self.policy.ttl)
+        if _weigh(entry) <= response_cache.maxsize:
+            response_cache.set(key, entry)
+        return _respond(entry, environ, start_response)
+
+
+def invalidate(endpoint=None):
+    '''
+    Remove cached responses of `endpoint`, which may be a view or its
+    name, or every cached response if it isn't given.
+
+    '''
+    if endpoint is None:
+        response_cache.clear()
+        return
+    endpoint = getattr(endpoint, 'reversable_with', endpoint)
+    response_cache.discard_where(lambda key: key[0] == endpoint)
@@ -0,0 +1,374 @@
+'''
+Multi-process and thread pool serving for a :class:`Manager`.
+
+A :class:`PreforkServer` opens the listening socket and freezes the app tree
+in a master process, then forks workers that share both copy-on-write. The
+master supervises the workers, respawning any that exit, and replaces them
+all gracefully on `SIGHUP`.
+
+A :class:`ThreadPoolMixIn` server handles requests on a fixed pool of threads
+fed by a bounded queue, and sheds load with a `503` when the queue is full.
+
+'''
+import errno
+import os
+import signal
+import socket
+import time
+import traceback
+from Queue import Queue, Full
+from threading import Lock, Thread
+
+from werkzeug.serving import (BaseWSGIServer, WSGIRequestHandler,
+                              select_ip_version)
+
+from roots.utils.log import log
+
+
+def listen(host, port, reuse_port=False, backlog=128):
+    ''':returns: a listening TCP socket bound to `host` and `port`.'''
+    sock = socket.socket(select_ip_version(host, port), socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class SocketWSGIServer(BaseWSGIServer):
+    '''
+    A Werkzeug WSGI server that accepts connections on an existing listening
+    socket rather than binding its own.
+
+    The socket is made non-blocking, so that when several processes wait on
+    the same socket the ones that lose the race to accept a connection go
+    back to waiting instead of blocking.
+
+    '''
+    def __init__(self, sock, app, handler=None):
+        self._listening_socket = sock
+        host, port = sock.getsockname()[:2]
+        super(SocketWSGIServer, self).__init__(host, port, app, handler)
+
+    def server_bind(self):
+        self.socket.close()
+        self.socket = self._listening_socket
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        host, port = self.server_address[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+
+    def server_activate(self):
+        pass
+
+    def get_request(self):
+        connection, address = self.socket.accept()
+        connection.setblocking(True)
+        return connection, address
+
+
+class ThreadPoolRequestHandler(WSGIRequestHandler):
+    '''
+    Adds the server to the WSGI environment as `roots.server`, so that its
+    :meth:`ThreadPoolMixIn.stats` can be reported.
+
+    '''
+    def make_environ(self):
+        environ = super(ThreadPoolRequestHandler, self).make_environ()
+        environ['roots.server'] = self.server
+        return environ
+
+
+class ThreadPoolMixIn(object):
+    '''
+    Mix-in for a Werkzeug WSGI server that handles requests on a fixed pool
+    of threads.
+
+    Accepted connections wait in a queue of at most `backlog` entries. When
+    the queue is full, the connection is answered immediately with a `503`
+    and a `Retry-After` header instead of waiting.
+
+    Call :meth:`start_pool` before serving, and :meth:`server_close` to stop
+    the threads once the queued requests are done. The :meth:`stats` of the
+    server are exported by :class:`roots.metrics.MetricsApp`.
+
+    '''
+    multithread = True
+
+    # Seconds to send in the `Retry-After` header of rejected requests.
+    retry_after = 1
+
+    def start_pool(self, threads, backlog):
+        self.threads = threads
+        self.backlog = backlog
+        self._queue = Queue(backlog)
+        self._stats_lock = Lock()
+        self._accepted = 0
+        self._rejected = 0
+        self._handled = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._pool = [Thread(target=self._pool_thread)
+                      for n in range(threads)]
+        for thread in self._pool:
+            thread.daemon = True
+            thread.start()
+
+        from roots.metrics import register_server
+        register_server(self)
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address, time.time()))
+        except Full:
+            with self._stats_lock:
+                self._rejected += 1
+            self._reject(request)
+            return
+        with self._stats_lock:
+            self._accepted += 1
+
+    def _reject(self, request):
+        body = 'Service Unavailable'
+        try:
+            request.sendall('HTTP/1.0 503 Service Unavailable\r\n'
+                            'Retry-After: %d\r\n'
+                            'Content-Type: text/plain\r\n'
+                            'Content-Length: %d\r\n'
+                            'Connection: close\r\n\r\n%s'
+                            % (self.retry_after, len(body), body))
+        except socket.error:
+            pass
+        self.shutdown_request(request)
+
+    def _pool_thread(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address, queued = item
+
+            wait = time.time() - queued
+            with self._stats_lock:
+                self._handled += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+    def stats(self):
+        ''':returns: a dictionary of queue and rejection counters.'''
+        with self._stats_lock:
+            return {
+                'threads': self.threads,
+                'backlog': self.backlog,
+                'queue_depth': self._queue.qsize(),
+                'accepted': self._accepted,
+                'rejected': self._rejected,
+                'handled': self._handled,
+                'wait_total': self._wait_total,
+                'wait_max': self._wait_max,
+                'wait_mean': self._wait_total / (self._handled or 1),
+                }
+
+    def server_close(self):
+        for thread in self._pool:
+            self._queue.put(None)
+        for thread in self._pool:
+            thread.join()
+        super(ThreadPoolMixIn, self).server_close()
+
+
+class ThreadPoolWSGIServer(ThreadPoolMixIn, BaseWSGIServer):
+    pass
+
+
+class ThreadPoolSocketWSGIServer(ThreadPoolMixIn, SocketWSGIServer):
+    pass
+
+
+def make_thread_pool_server(app, threads, backlog, host="localhost",
+                            port=8000, sock=None):
+    '''
+    Create a started :class:`ThreadPoolMixIn` server for `app`, either
+    listening on `host` and `port` or accepting on an existing socket.
+
+    '''
+    if sock is None:
+        server = ThreadPoolWSGIServer(host, port, app,
+                                      ThreadPoolRequestHandler)
+    else:
+        server = ThreadPoolSocketWSGIServer(sock, app,
+                                            ThreadPoolRequestHandler)
+    server.start_pool(threads, backlog)
+    return server
+
+
+class PreforkServer(object):
+    '''
+    Serve a :class:`Manager` from `workers` forked processes.
+
+    The app tree is frozen with :meth:`App.freeze` before forking, so routes
+    and configuration are shared copy-on-write. The master process respawns
+    workers that exit, replaces all workers on `SIGHUP` (each old worker
+    finishes its current request first), and stops on `SIGINT` or `SIGTERM`.
+
+    Because the app is imported before forking, `SIGHUP` does not pick up
+    code changes.
+
+    :param manager: The :class:`Manager` to serve.
+    :param workers: Number of worker processes.
+    :param reuse_port: Give each worker its own socket bound with
+        `SO_REUSEPORT`, letting the kernel balance connections between them,
+        instead of sharing one socket.
+    :param threads: If non-zero, each worker handles requests on a pool of
+        this many threads. See :class:`ThreadPoolMixIn`.
+    :param backlog: Size of each worker's request queue when using threads.
+
+    '''
+    # Seconds a worker must live for before it is respawned immediately.
+    # Workers that die sooner are respawned after this delay, so a broken
+    # app does not spin the master.
+    respawn_delay = 1.0
+
+    def __init__(self, manager, host="localhost", port=8000, workers=2,
+                 reuse_port=False, threads=0, backlog=64):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.reuse_port = reuse_port
+        self.threads = threads
+        self.backlog = backlog
+        self._socket = None
+        self._children = {}
+        self._signal = None
+
+    def make_worker_server(self, sock):
+        '''
+        :returns: the server run by each worker process on `sock`. Override
+            to change how a worker handles requests.
+
+        '''
+        if self.threads:
+            return make_thread_pool_server(
+                self.manager, self.threads, self.backlog, sock=sock)
+        return SocketWSGIServer(sock, self.manager)
+
+    def serve_forever(self):
+        self.manager.root.freeze()
+
+        # With `reuse_port` each worker binds its own socket. The master
+        # binds one briefly so that errors are reported up front.
+        self._socket = listen(self.host, self.port, self.reuse_port)
+        if self.reuse_port:
+            self._socket.close()
+        log('Running on http://%s:%d/ with %d workers',
+            self.host, self.port, self.workers)
+
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(sig, self._handle_signal)
+
+        try:
+            for n in range(self.workers):
+                self._spawn()
+            self._supervise()
+        finally:
+            self._stop_workers(list(self._children))
+            if not self.reuse_port:
+                self._socket.close()
+
+    def _handle_signal(self, signum, frame):
+        self._signal = signum
+
+    def _supervise(self):
+        while True:
+            if self._signal == signal.SIGHUP:
+                self._signal = None
+                log('Reloading workers')
+                old = list(self._children)
+                for n in range(self.workers):
+                    self._spawn()
+                self._stop_workers(old, wait=False)
+            elif self._signal is not None:
+                log('Shutting down')
+                return
+
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            started, retired = self._children.pop(pid, (None, True))
+            if retired or self._signal is not None:
+                continue
+
+            log('Worker %d exited with status %d, respawning', pid, status)
+            if time.time() - started < self.respawn_delay:
+                time.sleep(self.respawn_delay)
+            self._spawn()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = (time.time(), False)
+            return
+        os._exit(self._run_worker())
+
+    def _stop_workers(self, pids, wait=True):
+        for pid in pids:
+            if pid in self._children:
+                self._children[pid] = (self._children[pid][0], True)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        while wait and any(pid in self._children for pid in pids):
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+            self._children.pop(pid, None)
+
+    def _run_worker(self):
+        ''':returns: the exit status of the worker.'''
+        running = [True]
+
+        def _stop(signum, frame):
+            running[0] = False
+
+        # Let the current request finish rather than interrupting it.
+        signal.signal(signal.SIGTERM, _stop)
+        signal.siginterrupt(signal.SIGTERM, False)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        try:
+            sock = self._socket
+            if self.reuse_port:
+                sock = listen(self.host, self.port, reuse_port=True)
+            server = self.make_worker_server(sock)
+            server.timeout = 0.5
+            try:
+                while running[0]:
+                    server.handle_request()
+            finally:
+                server.server_close()
+                self.manager.drain_tasks()
+        except Exception:
+            traceback.print_exc()
+            return 1
+        return 0
@@ -0,0 +1,280 @@
+'''
+Serving static files.
+
+Mount a :class:`StaticApp` to serve a directory::
+
+    from roots.static import StaticApp
+
+    static = StaticApp('assets/')
+    app.mount(static, '/static/')
+
+URLs built with :attr:`StaticApp.versioned` include a hash of the file's
+content, and are cached by clients for a year::
+
+    env.reverse(static.versioned, filename='css/site.css')
+    # '/static/css/site.css?v=9e107d9d372b'
+
+'''
+import hashlib
+import mimetypes
+import mmap
+import os
+import stat
+from datetime import datetime
+from time import time
+
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, is_resource_modified, \
+    parse_accept_header, parse_range_header, quote_etag, unquote_etag
+from werkzeug.security import safe_join
+from werkzeug.wrappers import Response
+
+from roots.app import App
+from roots.utils.cache import LRUCache
+
+
+class _FileInfo(object):
+    '''The stat results and content hash of a file.'''
+    __slots__ = ('size', 'mtime', 'last_modified', 'hash', 'mimetype')
+
+    def __init__(self, path, stat_result, file_hash):
+        self.size = stat_result.st_size
+        self.mtime = stat_result.st_mtime
+        self.last_modified = datetime.utcfromtimestamp(int(self.mtime))
+        self.hash = file_hash
+        self.mimetype = (mimetypes.guess_type(path)[0] or
+                         'application/octet-stream')
+
+
+def _hash_file(path, buffer_size=65536):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(buffer_size), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _MappedFile(object):
+    '''
+    Iterates over `length` bytes of a file from `start`, reading them
+    through a memory map.
+
+    '''
+    def __init__(self, f, start, length, buffer_size):
+        self._file = f
+        self._map = length and \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._position = start
+        self._end = start + length
+        self._buffer_size = buffer_size
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._position >= self._end:
+            raise StopIteration()
+        end = min(self._position + self._buffer_size, self._end)
+        chunk = self._map[self._position:end]
+        if not chunk:
+            raise StopIteration()
+        self._position = end
+        return chunk
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+class _Versioned(object):
+    '''
+    A reversable for a :class:`StaticApp` that adds the content hash of the
+    file to URLs.
+
+    '''
+    def __init__(self, app):
+        self._app = app
+
+    @property
+    def reversable_with(self):
+        return self._app.endpoint
+
+    def url_values(self, kwargs):
+        version = self._app.version(kwargs['filename'])
+        if version is None:
+            return kwargs
+        return dict(kwargs, v=version)
+
+
+class StaticApp(App):
+    '''
+    App that serves the files in `directory`.
+
+    Files are sent with `wsgi.file_wrapper` when the server provides it, so
+    it can use `sendfile`, and are read through a memory map otherwise.
+    Single byte range requests are supported. If a file has a `.gz` sibling,
+    that is sent instead to clients accepting gzip encoding.
+
+    Responses have an `ETag` and `Last-Modified` header, and conditional
+    requests are answered with `304 Not Modified`. Stat results and content
+    hashes are cached for `stat_ttl` seconds, after which changes to files
+    are picked up.
+
+    :param directory: The directory to serve.
+    :param name: Name of the app, which is also the prefix of its view name.
+    :param max_age: Seconds clients may cache unversioned files for.
+    :param versioned_max_age: Seconds clients may cache files requested with
+        their current content hash, as built with :attr:`versioned`.
+    :param stat_ttl: Seconds to cache file stat results for, or `None` to
+        cache them until evicted.
+    :param gzip: Serve precompressed `.gz` files.
+
+    '''
+    # Size of the chunks read from files.
+    buffer_size = 256 * 1024
+
+    def __init__(self, directory, name='static', max_age=0,
+                 versioned_max_age=365 * 24 * 60 * 60, stat_ttl=2.0,
+                 gzip=True, stat_cache_size=4096):
+        super(StaticApp, self).__init__(name)
+        self.directory = os.path.abspath(directory)
+        self.max_age = max_age
+        self.versioned_max_age = versioned_max_age
+        self.stat_ttl = stat_ttl
+        self.gzip = gzip
+        self._stat_cache = LRUCache(stat_cache_size)
+
+        #: Pass to :meth:`ReverseEnv.reverse` with a `filename` to build a
+        #: URL including the file's content hash.
+        self.versioned = _Versioned(self)
+
+        @self.route('/<path:filename>', methods=['GET', 'HEAD'])
+        def asset(env, filename):
+            return self.file_response(env.environ, filename,
+                                      env.args.get('v'))
+        self.endpoint = asset.reversable_with
+
+    def _file_info(self, path):
+        ''':returns: a :class:`_FileInfo`, or `None` if there's no file.'''
+        now = time()
+        cached = self._stat_cache.get(path)
+        if cached is not None:
+            checked, info = cached
+            if self.stat_ttl is None or now - checked < self.stat_ttl:
+                return info
+        else:
+            info = None
+
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            info = None
+        else:
+            if not stat.S_ISREG(stat_result.st_mode):
+                info = None
+            elif info is None or (info.size, info.mtime) != (
+                    stat_result.st_size, stat_result.st_mtime):
+                info = _FileInfo(path, stat_result, _hash_file(path))
+        self._stat_cache.set(path, (now, info))
+        return info
+
+    def version(self, filename):
+        '''
+        :returns: the content hash used in versioned URLs for `filename`,
+            or `None` if there's no such file.
+
+        '''
+        path = safe_join(self.directory, filename)
+        info = path and self._file_info(path)
+        return info and info.hash[:12]
+
+    def file_response(self, environ, filename, version=None):
+        '''
+        :returns: a response for the file at `filename`, relative to the
+            served directory.
+
+        :param version: The content hash the file was requested with, if
+            any.
+
+        '''
+        path = safe_join(self.directory, filename)
+        info = path and self._file_info(path)
+        if info is None:
+            return NotFound()
+
+        headers = [('Accept-Ranges', 'bytes')]
+        if version is not None and version == info.hash[:12]:
+            headers.append(('Cache-Control', 'public, max-age=%d' %
+                            self.versioned_max_age))
+        else:
+            headers.append(('Cache-Control', 'public, max-age=%d' %
+                            self.max_age))
+
+        served, served_path = info, path
+        if self.gzip:
+            gzipped = self._file_info(path + '.gz')
+            if gzipped is not None:
+                headers.append(('Vary', 'Accept-Encoding'))
+                accept = parse_accept_header(
+                    environ.get('HTTP_ACCEPT_ENCODING'))
+                if accept['gzip'] > 0:
+                    served, served_path = gzipped, path + '.gz'
+                    headers.append(('Content-Encoding', 'gzip'))
+
+        headers.extend([
+                ('Content-Type', info.mimetype),
+                ('ETag', quote_etag(served.hash)),
+                ('Last-Modified', http_date(served.last_modified)),
+                ])
+
+        if not is_resource_modified(environ, served.hash,
+                                    last_modified=served.last_modified):
+            return Response(status=304, headers=headers)
+
+        status = 200
+        start, length = 0, served.size
+        byte_range = self._range(environ, served)
+        if byte_range is not None:
+            if byte_range is False:
+                headers.append(('Content-Range', 'bytes */%d' % served.size))
+                return Response(status=416, headers=headers)
+            status = 206
+            start, stop = byte_range
+            length = stop - start
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (
+                        start, stop - 1, served.size)))
+        headers.append(('Content-Length', str(length)))
+
+        body = ()
+        if environ['REQUEST_METHOD'] != 'HEAD':
+            body = self._body(environ, served_path, start, length,
+                              served.size)
+        return Response(body, status=status, headers=headers,
+                        direct_passthrough=True)
+
+    def _range(self, environ, info):
+        '''
+        :returns: the (start, stop) byte range requested, `None` to send the
+            whole file, or `False` if the range can't be satisfied.
+
+        '''
+        if 'HTTP_RANGE' not in environ:
+            return None
+        if_range = environ.get('HTTP_IF_RANGE')
+        if if_range and unquote_etag(if_range)[0] != info.hash and \
+                if_range != http_date(info.last_modified):
+            return None
+
+        byte_range = parse_range_header(environ['HTTP_RANGE'])
+        if byte_range is None or len(byte_range.ranges) != 1:
+            # Multiple ranges aren't supported; send the whole file.
+            return None
+        return byte_range.range_for_length(info.size) or False
+
+    def _body(self, environ, path, start, length, size):
+        f = open(path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and start == 0 and length == size:
+            return file_wrapper(f, self.buffer_size)
+        return _MappedFile(f, start, length, self.buffer_size)
@@ -0,0 +1,192 @@
+'''
+Background tasks deferred by views with :meth:`DeferEnv.defer`, run after
+the response has been sent.
+
+Each :class:`Manager` owns a :class:`TaskPool`, configured by these options
+before the first request:
+
+`task_workers`
+    Number of threads running tasks. Default: 2.
+`task_queue_size`
+    Maximum number of tasks waiting for a thread. Default: 1000.
+`task_policy`
+    What to do with a task when the queue is full: 'block' the request
+    thread until there is room, for up to `task_block_timeout` seconds
+    (default: indefinitely), or 'drop' the task. Either way, dropped tasks
+    are counted and logged. Default: 'block'.
+`task_drain_timeout`
+    Seconds to wait for queued tasks when the server stops. Default: 30.
+
+Tasks that raise are logged to stderr with their traceback.
+
+'''
+import os
+import traceback
+from Queue import Queue, Full
+from threading import Lock, Thread
+from time import time
+
+from roots.app import RootsConfigError
+from roots.utils.log import log
+from roots.utils.wsgi import close_after
+
+
+class TaskPool(object):
+    '''
+    Runs tasks on a fixed pool of `workers` threads, fed by a queue of at
+    most `max_queue` tasks.
+
+    Threads are started with the first task, and again in a process forked
+    after that.
+
+    :param policy: 'block' to wait for room in a full queue, for up to
+        `block_timeout` seconds, or 'drop' to drop tasks immediately.
+
+    '''
+    def __init__(self, workers=2, max_queue=1000, policy='block',
+                 block_timeout=None):
+        if policy not in ('block', 'drop'):
+            raise RootsConfigError(
+                "Task policy must be 'block' or 'drop', not %r" % policy)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self._lock = Lock()
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._closed = False
+        self._submitted = 0
+        self._dropped = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads and queued tasks of a parent process aren't inherited.
+            self._queue = Queue(self.max_queue)
+            self._threads = [Thread(target=self._worker)
+                             for n in range(self.workers)]
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, fn, *args, **kwargs):
+        '''
+        Queue `fn(*args, **kwargs)` to run on a worker thread.
+
+        :returns: whether the task was queued, rather than dropped.
+
+        '''
+        if self._closed:
+            return self._drop(fn, "the pool is shut down")
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            if self.policy == 'block':
+                self._queue.put((fn, args, kwargs), True, self.block_timeout)
+            else:
+                self._queue.put_nowait((fn, args, kwargs))
+        except Full:
+            return self._drop(fn, "the queue is full")
+        with self._lock:
+            self._submitted += 1
+        return True
+
+    def run_after(self, app_iter, tasks):
+        '''
+        :returns: the response iterable `app_iter`, wrapped to submit
+            `tasks`, a list of `(fn, args, kwargs)` tuples, once it is
+            closed.
+
+        '''
+        def submit():
+            for fn, args, kwargs in tasks:
+                self.submit(fn, *args, **kwargs)
+        return close_after(app_iter, submit)
+
+    def _drop(self, fn, reason):
+        with self._lock:
+            self._dropped += 1
+        log("Dropped deferred task %r: %s", fn, reason)
+        return False
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            fn, args, kwargs = task
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self._failed += 1
+                log("Deferred task %r failed", fn)
+                traceback.print_exc()
+            else:
+                with self._lock:
+                    self._completed += 1
+
+    def shutdown(self, timeout=None):
+        '''
+        Stop accepting tasks, and wait up to `timeout` seconds, or
+        indefinitely, for the queued ones to run.
+
+        :returns: whether every queued task ran.
+
+        '''
+        self._closed = True
+        if self._pid != os.getpid():
+            return True
+
+        deadline = None if timeout is None else time() + timeout
+        for thread in self._threads:
+            try:
+                self._queue.put(None, True, deadline and
+                                max(deadline - time(), 0))
+            except Full:
+                break
+        for thread in self._threads:
+            # Without a timeout, `join` can't be interrupted.
+            while thread.is_alive():
+                remaining = 1 if deadline is None else deadline - time()
+                if remaining <= 0:
+                    break
+                thread.join(min(remaining, 1))
+
+        if any(thread.is_alive() for thread in self._threads):
+            log("Stopped before every deferred task ran")
+            return False
+        return True
+
+    def stats(self):
+        ''':returns: a dictionary of queue and task counters.'''
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queue_depth': self._queue.qsize() if self._queue else 0,
+                'submitted': self._submitted,
+                'dropped': self._dropped,
+                'completed': self._completed,
+                'failed': self._failed,
+                }
+
+
+def pool_for(manager):
+    '''
+    :returns: a :class:`TaskPool` configured by the `task_*` options of
+        `manager`.
+
+    '''
+    config = manager.config
+    return TaskPool(workers=config.get('task_workers', 2),
+                    max_queue=config.get('task_queue_size', 1000),
+                    policy=config.get('task_policy', 'block'),
+                    block_timeout=config.get('task_block_timeout'))
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    '''
+    A thread-safe dictionary bounded to `maxsize` entries. When full, the
+    least recently used entry is evicted.
+
+    Hits, misses and evictions are counted for reporting.
+
+    :param maxsize: Maximum number of entries, or total weight of the
+        entries if `weigh` is given.
+    :param weigh: Optional function returning the weight of a value, such
+        as its size in bytes.
+
+    '''
+    def __init__(self, maxsize, weigh=None):
+        self.maxsize = maxsize
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def _weigh(self, value):
+        return 1 if self.weigh is None else self.weigh(value)
+
+    def get(self, key, default=None):
+        ''':returns: the value for `key`, marking it as recently used.'''
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        '''
+        Store `value`, evicting the least recently used entries while the
+        cache is over its maximum size.
+
+        '''
+        with self._lock:
+            if key in self._data:
+                self.weight -= self._weigh(self._data.pop(key))
+            self._data[key] = value
+            self.weight += self._weigh(value)
+            while self.weight > self.maxsize and self._data:
+                self.weight -= self._weigh(self._data.popitem(last=False)[1])
+                self.evictions += 1
+
+    def discard(self, key):
+        '''Remove `key` if present.'''
+        with self._lock:
+            if key in self._data:
+                self.weight -= self._weigh(self._data.pop(key))
+
+    def discard_where(self, predicate):
+        '''Remove every entry whose key satisfies `predicate`.'''
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                self.weight -= self._weigh(self._data.pop(key))
+
+    def clear(self):
+        '''Remove all entries. Counters are kept.'''
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        ''':returns: a dictionary of the cache counters.'''
+        stats = {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            }
+        if self.weigh is not None:
+            stats['weight'] = self.weight
+        return stats
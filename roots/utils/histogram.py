@@ -0,0 +1,126 @@
+from bisect import bisect_left
+from threading import RLock, local
+from weakref import ref
+
+
+# Upper bounds, in seconds, of the default latency buckets.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ThreadMarker(object):
+    '''Held by each recording thread, so its exit can be noticed.'''
+    __slots__ = ('__weakref__',)
+
+
+def _add(totals, key, histogram):
+    total = totals.get(key)
+    if total is None:
+        totals[key] = list(histogram)
+    else:
+        for n, value in enumerate(histogram):
+            total[n] += value
+
+
+def summarize(buckets, histograms):
+    '''
+    Summarize a :meth:`LatencyHistograms.snapshot`.
+
+    :returns: a dictionary mapping each key to the count, mean and estimated
+        50th, 95th and 99th percentiles in seconds. The percentiles are the
+        upper bound of the bucket they fall in.
+
+    '''
+    summary = {}
+    bounds = tuple(buckets) + (float('inf'),)
+    for key, histogram in histograms.items():
+        counts, total = histogram[:-1], histogram[-1]
+        count = sum(counts)
+        stats = {'count': count, 'mean': total / (count or 1)}
+        for p in (50, 95, 99):
+            rank = p / 100.0 * count
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                if cumulative >= rank:
+                    break
+            stats['p%d' % p] = bound
+        summary[key] = stats
+    return summary
+
+
+class LatencyHistograms(object):
+    '''
+    Latency histograms keyed by endpoint and phase.
+
+    Each thread records into its own histograms without locking. Reading
+    merges the histograms of every thread, and histograms of threads that
+    have exited are kept in a running total.
+
+    :param buckets: Upper bounds of the buckets in seconds, in ascending
+        order. A final bucket holds everything larger.
+
+    '''
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = local()
+        self._lock = RLock()
+        # Histograms of each live thread, keyed by a weak reference to the
+        # thread's marker.
+        self._threads = {}
+        self._retired = {}
+
+    def _thread_histograms(self):
+        try:
+            return self._local.histograms
+        except AttributeError:
+            marker = _ThreadMarker()
+            histograms = {}
+            with self._lock:
+                self._threads[ref(marker, self._retire)] = histograms
+            self._local.marker = marker
+            self._local.histograms = histograms
+            return histograms
+
+    def _retire(self, marker_ref):
+        # The thread has exited, taking its marker with it.
+        with self._lock:
+            for key, histogram in self._threads.pop(marker_ref).items():
+                _add(self._retired, key, histogram)
+
+    def observe(self, endpoint, phase, seconds):
+        '''Record that `phase` of a request to `endpoint` took `seconds`.'''
+        histograms = self._thread_histograms()
+        histogram = histograms.get((endpoint, phase))
+        if histogram is None:
+            # Bucket counts, followed by the sum of all observations.
+            histogram = histograms[(endpoint, phase)] = \
+                [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def snapshot(self):
+        '''
+        :returns: a dictionary mapping `(endpoint, phase)` to a list of the
+            count in each bucket (not cumulative), followed by the sum of all
+            observations in seconds.
+
+        '''
+        with self._lock:
+            totals = dict((key, list(histogram))
+                          for key, histogram in self._retired.items())
+            for histograms in self._threads.values():
+                for key, histogram in histograms.items():
+                    _add(totals, key, histogram)
+        return totals
+
+    def summary(self):
+        ''':returns: :func:`summarize` of the current histograms.'''
+        return summarize(self.buckets, self.snapshot())
+
+    def clear(self):
+        '''Discard all recorded observations.'''
+        with self._lock:
+            self._retired.clear()
+            for histograms in self._threads.values():
+                histograms.clear()
@@ -0,0 +1,6 @@
+import sys
+
+
+def log(message, *args):
+    '''Write `message`, formatted with `args`, to stderr as a status line.'''
+    sys.stderr.write(' * %s\n' % (message % args))
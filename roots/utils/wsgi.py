@@ -0,0 +1,29 @@
+from werkzeug.wsgi import ClosingIterator
+
+
+# Returned by no iterator, to end `iter(callable, sentinel)` on StopIteration
+# only.
+_END = object()
+
+
+def close_after(app_iter, callback):
+    '''
+    Wrap the iterable of a response to call `callback` once it is closed.
+
+    Unlike a bare :class:`werkzeug.wsgi.ClosingIterator`, `app_iter` itself
+    is closed, rather than the iterator it returns, and `callback` is called
+    even if closing it raises.
+
+    :returns: a :class:`werkzeug.wsgi.ClosingIterator`.
+
+    '''
+    def close():
+        try:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        finally:
+            callback()
+
+    # Iterate through a callable iterator, which has no `close` of its own
+    # for `ClosingIterator` to call ahead of ours.
+    return ClosingIterator(iter(iter(app_iter).next, _END), close)
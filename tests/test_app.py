@@ -0,0 +1,64 @@
+'''
+Changes to the routes of an app tree after it has been mounted.
+
+'''
+import unittest
+
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse, Response
+
+from roots.app import App
+from roots.manager import Manager
+
+
+def _make_tree():
+    root = App('root')
+    child = App('child')
+
+    for path in ('first', 'second', 'third'):
+        @child.route('/%s' % path, name=path)
+        def view(env, path=path):
+            return Response(path * 1000)
+
+    root.mount(child, '/child')
+    return root, child
+
+
+class RemoveRouteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root, self.child = _make_tree()
+        self.client = Client(Manager(self.root), BaseResponse)
+
+    def assertServes(self, *paths):
+        for path in paths:
+            response = self.client.get('/child/' + path)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertEqual(response.data, path * 1000)
+
+    def assertNotFound(self, *paths):
+        for path in paths:
+            response = self.client.get('/child/' + path)
+            self.assertEqual(response.status_code, 404, path)
+
+    def test_remove_route(self):
+        self.child.remove_route('second')
+        self.assertServes('first', 'third')
+        self.assertNotFound('second')
+
+    def test_remove_route_then_remount(self):
+        self.child.remove_route('second')
+        self.root.unmount(self.child)
+        self.assertNotFound('first', 'second', 'third')
+
+        self.root.mount(self.child, '/child')
+        self.assertServes('first', 'third')
+        self.assertNotFound('second')
+
+    def test_remove_route_then_compress(self):
+        self.child.remove_route('second')
+        self.child.compress()
+        response = self.client.get('/child/third',
+                                   headers=[('Accept-Encoding', 'gzip')])
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertNotFound('second')
@@ -0,0 +1,86 @@
+'''
+Serves an app tree in-process with :mod:`roots.integration.gevent`.
+
+gevent requires the standard library to be patched before roots is
+imported, so this module patches it on import. Run it on its own::
+
+    python -m unittest tests.test_gevent
+
+'''
+try:
+    from gevent import monkey
+    monkey.patch_all()
+except ImportError:
+    monkey = None
+
+import time
+import unittest
+import urllib2
+
+from werkzeug.wrappers import Response
+
+from roots.app import App
+from roots.manager import Manager
+
+
+def _make_app():
+    app = App('g')
+
+    @app.route('/slow/<int:n>')
+    def slow(env, n):
+        # Patched, so this yields to the other requests.
+        time.sleep(0.5)
+        return Response('%d %s' % (n, env.reverse(slow, n=n)))
+
+    from roots.integration.gevent import threaded
+
+    @app.route('/threaded')
+    @threaded
+    def blocking(env):
+        time.sleep(0.2)
+        return Response('%s %s %s' % (env.method, env.config['name'],
+                                      env.reverse('g:blocking')))
+
+    return app
+
+
+@unittest.skipIf(monkey is None, "gevent is not installed")
+class GeventServeTest(unittest.TestCase):
+
+    def setUp(self):
+        import gevent
+        from roots.integration.gevent import make_server
+        self.gevent = gevent
+        manager = Manager(_make_app(), config={'name': 'roots'})
+        self.server = make_server(manager, port=0, connections=100,
+                                  threads=4)
+        self.server.log = None
+        self.server.start()
+        self.url = 'http://localhost:%d' % self.server.server_port
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _get_all(self, paths):
+        ''':returns: the bodies of concurrent requests, and the time taken.'''
+        started = time.time()
+        jobs = [self.gevent.spawn(lambda path=path: urllib2.urlopen(
+                    self.url + path).read()) for path in paths]
+        self.gevent.joinall(jobs, raise_error=True)
+        return [job.value for job in jobs], time.time() - started
+
+    def test_slow_views_run_concurrently(self):
+        bodies, elapsed = self._get_all(['/slow/%d' % n for n in range(20)])
+        self.assertEqual(bodies, ['%d /slow/%d' % (n, n) for n in range(20)])
+        # Serially, this would take 10 seconds.
+        self.assertLess(elapsed, 2)
+
+    def test_threaded_views_get_the_environment(self):
+        bodies, elapsed = self._get_all(['/threaded'] * 4)
+        self.assertEqual(bodies, ['GET roots /threaded'] * 4)
+        # The pool has 4 threads, so these run in parallel.
+        self.assertLess(elapsed, 0.6)
+
+
+if __name__ == '__main__':
+    unittest.main()